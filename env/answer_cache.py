@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import metrics
+
+
+# Cache of generated answers keyed by the (normalized) message embedding. A
+# lookup is one matrix-vector product over a preallocated slot matrix, so it
+# stays well under a millisecond at a few thousand entries.
+class SemanticCache:
+    def __init__(self, threshold=0.9, ttl=6 * 3600, max_size=4096):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.matrix = None
+        self.answers = [None] * max_size
+        self.expires = np.zeros(max_size)
+        self.lru = OrderedDict()
+        self.free = list(range(max_size - 1, -1, -1))
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _best(self, vec, now):
+        if self.matrix is None or not self.lru:
+            return None, -1.0
+        scores = self.matrix @ vec
+        scores[self.expires <= now] = -np.inf
+        i = int(np.argmax(scores))
+        return i, float(scores[i])
+
+    def _release(self, i):
+        self.lru.pop(i, None)
+        self.answers[i] = None
+        self.expires[i] = 0
+        self.free.append(i)
+
+    def lookup(self, vec):
+        vec = np.asarray(vec, dtype=np.float32).reshape(-1)
+        now = time.monotonic()
+        with self.lock:
+            i, score = self._best(vec, now)
+            if i is not None and score >= self.threshold:
+                self.lru.move_to_end(i)
+                self.hits += 1
+                metrics.cache_lookup('answer', True)
+                return self.answers[i]
+            self.misses += 1
+            metrics.cache_lookup('answer', False)
+            return None
+
+    def put(self, vec, answer):
+        vec = np.asarray(vec, dtype=np.float32).reshape(-1)
+        now = time.monotonic()
+        with self.lock:
+            if self.matrix is None:
+                self.matrix = np.zeros((self.max_size, vec.shape[0]), dtype=np.float32)
+            i, score = self._best(vec, now)
+            if i is None or score < self.threshold:
+                # Reclaim expired slots before evicting the least recently used one
+                for slot in [s for s in self.lru if self.expires[s] <= now]:
+                    self._release(slot)
+                if not self.free:
+                    self._release(next(iter(self.lru)))
+                    self.evictions += 1
+                i = self.free.pop()
+            self.matrix[i] = vec
+            self.answers[i] = answer
+            self.expires[i] = now + self.ttl
+            self.lru[i] = None
+            self.lru.move_to_end(i)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'size': len(self.lru),
+                'threshold': self.threshold,
+            }
@@ -0,0 +1,52 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlparse
+
+# Stand-in for browser_pool: "loading" a search page sleeps `latency` seconds
+# and serves a saved bakeryclick.com result page from bench/pages.
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pages")
+EMPTY_PAGE = "<html><body></body></html>"
+
+latency = 0.0
+pages = {}
+
+
+def load(fixtures, page_load=0.0):
+    global latency
+    latency = page_load
+    for term, filename in fixtures.get('pages', {}).items():
+        with open(os.path.join(PAGES_DIR, filename), encoding='utf-8') as f:
+            pages[term] = f.read()
+
+
+class FakeDriver:
+    def __init__(self):
+        self.page_source = EMPTY_PAGE
+
+    def get(self, url):
+        time.sleep(latency)
+        term = parse_qs(urlparse(url).query).get('q', [''])[0]
+        self.page_source = pages.get(term, EMPTY_PAGE)
+
+
+class DriverPool:
+    def __init__(self, size=2, **kwargs):
+        self.slots = threading.BoundedSemaphore(size)
+        self.loads = 0
+
+    @contextmanager
+    def driver(self):
+        with self.slots:
+            self.loads += 1
+            yield FakeDriver()
+
+    def warm(self, count=1):
+        pass
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {'loads': self.loads}
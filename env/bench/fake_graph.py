@@ -0,0 +1,82 @@
+import threading
+import time
+import metrics
+
+# In-memory stand-in for graph_db. It answers the queries the chatbots issue
+# from fixture data and sleeps `latency` seconds per transaction, like one
+# Neo4j round trip.
+DATABASE = None
+
+latency = 0.0
+greetings = {}
+users = {}
+answers = {}
+_lock = threading.Lock()
+_stats = {'reads': 0, 'writes': 0, 'queries': 0, 'rows_written': 0, 'unknown': 0}
+
+
+def load(fixtures, round_trip=0.0):
+    global latency
+    latency = round_trip
+    greetings.update(fixtures.get('greetings', {}))
+    users.update(fixtures.get('users', {}))
+    answers.update(fixtures.get('answers', {}))
+
+def get_driver():
+    raise RuntimeError("The benchmark graph has no driver")
+
+def close():
+    pass
+
+
+def _answer(query, parameters):
+    if 'UNWIND $rows' in query:
+        rows = parameters.get('rows', [])
+        with _lock:
+            _stats['rows_written'] += len(rows)
+            if 'SET u.name' in query:
+                for row in rows:
+                    users[row['uid']] = row['name']
+        return []
+    if 'RETURN u.name AS name' in query:
+        name = users.get(parameters['uid'])
+        return [{'name': name}] if name else []
+    if 'RETURN a.text AS answer' in query:
+        answer = answers.get(parameters['question'])
+        return [{'answer': answer}] if answer else []
+    if 'MATCH (n:Question) WHERE n.question IS NOT NULL' in query:
+        return [{'question': question, 'reply': reply} for question, reply in greetings.items()]
+    if 'MATCH (n:Greeting) WHERE n.name IS NOT NULL' in query:
+        return [{'name': name, 'reply': reply} for name, reply in greetings.items()]
+    if query.lstrip().startswith('CREATE'):
+        return []
+    with _lock:
+        _stats['unknown'] += 1
+    return []
+
+def _execute(kind, queries):
+    metrics.round_trip()
+    time.sleep(latency)
+    with _lock:
+        _stats[kind] += 1
+        _stats['queries'] += len(queries)
+    return [_answer(query, parameters or {}) for query, parameters in queries]
+
+def read_query(query, parameters=None):
+    return _execute('reads', [(query, parameters)])[0]
+
+def write_query(query, parameters=None):
+    return _execute('writes', [(query, parameters)])[0]
+
+def read_queries(*queries):
+    return _execute('reads', list(queries))
+
+def write_queries(*queries):
+    return _execute('writes', list(queries))
+
+def is_unavailable(error):
+    return False
+
+def query_stats():
+    with _lock:
+        return dict(_stats)
@@ -0,0 +1,146 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local HTTP stand-ins for the LINE Messaging API and Ollama, each with a
+# configurable delay. They run on 127.0.0.1 with an OS-assigned port.
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Server:
+    def __init__(self, handler):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.httpd.daemon_threads = True
+        self.httpd.service = self
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+class _LineHandler(_Handler):
+    def do_POST(self):
+        service = self.server.service
+        payload = self.read_json()
+        time.sleep(service.latency)
+        if self.path == '/v2/bot/message/reply':
+            service.delivered(payload.get('replyToken'), payload.get('messages', []), pushed=False)
+        elif self.path == '/v2/bot/message/push':
+            service.delivered(payload.get('to'), payload.get('messages', []), pushed=True)
+        else:
+            self.send_json(404, {'message': 'Not found'})
+            return
+        self.send_json(200, {})
+
+
+# Records when each reply token (or pushed-to user) first received messages,
+# so the harness can measure the latency the user perceives.
+class FakeLine(_Server):
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.waiters = {}
+        self.replies = 0
+        self.pushes = 0
+        super().__init__(_LineHandler)
+
+    def expect(self, key):
+        done = threading.Event()
+        with self.lock:
+            self.waiters[key] = [done, None, None]
+        return done
+
+    def delivered(self, key, messages, pushed):
+        with self.lock:
+            if pushed:
+                self.pushes += 1
+            else:
+                self.replies += 1
+            waiter = self.waiters.get(key)
+            if waiter and waiter[1] is None:
+                waiter[1] = time.perf_counter()
+                waiter[2] = [message.get('text', '') for message in messages]
+                waiter[0].set()
+
+    def result(self, key):
+        with self.lock:
+            _, delivered, texts = self.waiters.pop(key, (None, None, None))
+        return delivered, texts
+
+
+class _OllamaHandler(_Handler):
+    def do_POST(self):
+        service = self.server.service
+        payload = self.read_json()
+        if self.path != '/api/generate':
+            self.send_json(404, {'error': 'not found'})
+            return
+        words = service.next_answer().split()
+        # One word stands in for one token
+        limit = (payload.get('options') or {}).get('num_predict')
+        if limit:
+            words = words[:limit]
+        time.sleep(service.first_token)
+        if not payload.get('stream', True):
+            time.sleep(service.token_latency * len(words))
+            self.send_json(200, {'response': ' '.join(words), 'done': True, 'eval_count': len(words)})
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for word in words:
+                time.sleep(service.token_latency)
+                self._chunk({'response': word + ' ', 'done': False})
+            self._chunk({'response': '', 'done': True, 'eval_count': len(words)})
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stops reading once its deadline has passed
+            pass
+
+    def _chunk(self, data):
+        line = json.dumps(data).encode() + b'\n'
+        self.wfile.write(f"{len(line):x}\r\n".encode() + line + b'\r\n')
+        self.wfile.flush()
+
+
+# Streams a canned answer one word per token_latency seconds after first_token.
+# Each answer starts with "#<n>", so a reply carrying an n that was already
+# delivered came out of a cache rather than a fresh generation.
+class FakeOllama(_Server):
+    def __init__(self, answer, first_token=0.0, token_latency=0.0):
+        self.answer = answer
+        self.first_token = first_token
+        self.token_latency = token_latency
+        self.lock = threading.Lock()
+        self.requests = 0
+        super().__init__(_OllamaHandler)
+
+    def next_answer(self):
+        with self.lock:
+            self.requests += 1
+            return f"#{self.requests} {self.answer}"
@@ -0,0 +1,352 @@
+import argparse
+import base64
+import hashlib
+import hmac
+import importlib
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Replays bench/corpus.jsonl against chatbot01 and chatbot02 with LINE, Neo4j,
+# Ollama and bakeryclick.com replaced by local fakes, and reports throughput
+# and p50/p95/p99 latency per code path. Latency is measured from the webhook
+# POST to the first message LINE receives for that event (an acknowledgement
+# counts), i.e. what the user waits for.
+#
+#   cd env && python bench/run.py                    # compare with bench/baseline.json
+#   cd env && python bench/run.py --save-baseline    # record a new baseline
+#
+# The committed baseline is recorded with --fake-encoder and the default
+# settings. A baseline is the worst of --baseline-runs fresh runs (each in its
+# own process, so caches start cold), because a single run's p95/p99 over a
+# few dozen samples moves by tens of percent from run to run.
+#
+# Exits 1 when a p95/p99 or the throughput regresses past the baseline, and 2
+# when there is nothing to compare against (no baseline, a baseline for other
+# settings, or one without the bot that was run), so a check cannot pass
+# without comparing anything.
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ENV_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ENV_DIR)
+
+import fake_browser
+import fake_encoder
+import fake_graph
+from fake_services import FakeLine, FakeOllama
+
+CHANNEL_ACCESS_TOKEN = "bench-access-token"
+CHANNEL_SECRET = "bench-channel-secret"
+ACK_PREFIXES = ("ขอเวลาสักครู่", "กำลังค้นหาสินค้า")
+ANSWER_NUMBER = re.compile(r"#(\d+)")
+BOTS = ["chatbot01", "chatbot02"]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay webhook traffic against the chatbots")
+    parser.add_argument("--bot", choices=BOTS + ["both"], default="both")
+    parser.add_argument("--corpus", default=os.path.join(BENCH_DIR, "corpus.jsonl"))
+    parser.add_argument("--fixtures", default=os.path.join(BENCH_DIR, "fixtures.json"))
+    parser.add_argument("--baseline", default=os.path.join(BENCH_DIR, "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--baseline-runs", type=int, default=5, help="runs a saved baseline is the worst of")
+    parser.add_argument("--output", help="write the full report as JSON")
+    parser.add_argument("--repeat", type=int, default=20, help="replays of every conversation")
+    parser.add_argument("--concurrency", type=int, default=8, help="conversations in flight")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for a reply")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--slack", type=float, default=0.005, help="absolute seconds ignored in comparisons")
+    parser.add_argument("--line-latency", type=float, default=0.05)
+    parser.add_argument("--graph-latency", type=float, default=0.003)
+    parser.add_argument("--ollama-first-token", type=float, default=0.3)
+    parser.add_argument("--ollama-token-latency", type=float, default=0.03)
+    parser.add_argument("--browser-latency", type=float, default=1.5)
+    parser.add_argument("--fake-encoder", action="store_true",
+                        help="hashing encoder instead of the sentence-transformers model")
+    parser.add_argument("--encoder-latency", type=float, default=0.0)
+    return parser.parse_args(argv)
+
+def settings(args):
+    keys = ["repeat", "concurrency", "line_latency", "graph_latency", "ollama_first_token",
+            "ollama_token_latency", "browser_latency", "fake_encoder", "encoder_latency"]
+    return {key: getattr(args, key) for key in keys}
+
+
+# Fakes have to be in place before a chatbot module is imported: the bots read
+# usr_champ.txt, load the greeting index and start their clients at import.
+def install_fakes(args, fixtures):
+    line = FakeLine(args.line_latency)
+    ollama = FakeOllama(fixtures['ollama_answer'], args.ollama_first_token, args.ollama_token_latency)
+    os.environ["LINE_API_ENDPOINT"] = line.url
+    os.environ["OLLAMA_URL"] = ollama.url
+
+    fake_graph.load(fixtures, args.graph_latency)
+    fake_browser.load(fixtures, args.browser_latency)
+    sys.modules['graph_db'] = fake_graph
+    sys.modules['browser_pool'] = fake_browser
+    if args.fake_encoder:
+        fake_encoder.latency = args.encoder_latency
+        sys.modules['encoder'] = fake_encoder
+
+    os.chdir(tempfile.mkdtemp(prefix="easytech-bench-"))
+    with open('usr_champ.txt', 'w') as f:
+        f.write(f"{CHANNEL_ACCESS_TOKEN}\n{CHANNEL_SECRET}\n")
+    return line, ollama
+
+def load_bot(name):
+    bot = importlib.import_module(name)
+    crawler = getattr(bot, 'catalog_crawler', None)
+    if crawler is not None:
+        # Only the term the crawler is already on gets stored, so runs start
+        # from the same catalog
+        crawler.stop()
+        crawler.thread.join()
+    return bot
+
+
+def webhook_body(uid, text, reply_token):
+    now = int(time.time() * 1000)
+    event = {
+        'type': 'message',
+        'mode': 'active',
+        'timestamp': now,
+        'webhookEventId': uuid.uuid4().hex,
+        'deliveryContext': {'isRedelivery': False},
+        'source': {'type': 'user', 'userId': uid},
+        'replyToken': reply_token,
+        'message': {'type': 'text', 'id': str(now), 'quoteToken': uuid.uuid4().hex, 'text': text},
+    }
+    return json.dumps({'destination': 'Ubench', 'events': [event]}, ensure_ascii=False).encode()
+
+def sign(body):
+    return base64.b64encode(hmac.new(CHANNEL_SECRET.encode(), body, hashlib.sha256).digest()).decode()
+
+
+class Replay:
+    def __init__(self, bot, line, fixtures, timeout):
+        self.bot = bot
+        self.line = line
+        self.questions = fixtures['ollama_questions']
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.next_question = 0
+        self.answers_seen = set()
+        self.samples = defaultdict(list)
+        self.timeouts = 0
+        self.acknowledged = 0
+
+    def question(self):
+        with self.lock:
+            question = self.questions[self.next_question % len(self.questions)]
+            self.next_question += 1
+        return question
+
+    def send(self, client, uid, text, path):
+        reply_token = uuid.uuid4().hex
+        body = webhook_body(uid, text, reply_token)
+        done = self.line.expect(reply_token)
+        start = time.perf_counter()
+        client.post('/', data=body, headers={'X-Line-Signature': sign(body), 'Content-Type': 'application/json'})
+        webhook = time.perf_counter() - start
+        done.wait(self.timeout)
+        delivered, texts = self.line.result(reply_token)
+        with self.lock:
+            self.samples['webhook'].append(webhook)
+            if delivered is None:
+                self.timeouts += 1
+                return
+            if texts and texts[0].startswith(ACK_PREFIXES):
+                self.acknowledged += 1
+            else:
+                path = self._observed_path(path, texts)
+            self.samples[path].append(delivered - start)
+
+    # A generated answer is numbered by the fake Ollama; seeing a number again
+    # means the answer cache served it.
+    def _observed_path(self, path, texts):
+        if path not in ('ollama', 'answer_cache'):
+            return path
+        match = ANSWER_NUMBER.search(" ".join(texts))
+        if not match:
+            return path
+        if match.group(1) in self.answers_seen:
+            return 'answer_cache'
+        self.answers_seen.add(match.group(1))
+        return 'ollama'
+
+    def conversation(self, uid, messages):
+        client = self.bot.app.test_client()
+        question = self.question() if any('{question}' in m['text'] for m in messages) else None
+        for message in messages:
+            self.send(client, uid, message['text'].replace('{question}', question or ''), message['path'])
+
+    def run(self, conversations, repeat, concurrency):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [pool.submit(self.conversation, f"Ubench{i:04d}c{j:02d}", conversation['messages'])
+                       for i in range(repeat) for j, conversation in enumerate(conversations)]
+            for future in futures:
+                future.result()
+        return time.perf_counter() - started
+
+
+def summarize(samples):
+    values = np.asarray(samples)
+    return {
+        'count': len(samples),
+        'p50': float(np.percentile(values, 50)),
+        'p95': float(np.percentile(values, 95)),
+        'p99': float(np.percentile(values, 99)),
+        'max': float(values.max()),
+    }
+
+def bench_bot(name, args, line, fixtures, corpus):
+    conversations = [conversation for conversation in corpus if conversation['bot'] == name]
+    bot = load_bot(name)
+    replay = Replay(bot, line, fixtures, args.timeout)
+    seconds = replay.run(conversations, args.repeat, args.concurrency)
+    events = len(replay.samples['webhook'])
+    return {
+        'events': events,
+        'seconds': seconds,
+        'throughput': events / seconds if seconds else 0.0,
+        'timeouts': replay.timeouts,
+        'acknowledged': replay.acknowledged,
+        'paths': {path: summarize(samples) for path, samples in sorted(replay.samples.items())},
+        'stats': bot.app.test_client().get('/stats').get_json(),
+        'metrics': bot.app.test_client().get('/metrics').get_data(as_text=True),
+    }
+
+def print_report(report):
+    for name, result in report['bots'].items():
+        print(f"\n{name}: {result['events']} events in {result['seconds']:.2f}s, "
+              f"{result['throughput']:.1f} events/s, {result['acknowledged']} acknowledged first, "
+              f"{result['timeouts']} timed out")
+        print(f"  {'path':<16}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for path, s in result['paths'].items():
+            print(f"  {path:<16}{s['count']:>7}{s['p50'] * 1000:>10.1f}{s['p95'] * 1000:>10.1f}"
+                  f"{s['p99'] * 1000:>10.1f}{s['max'] * 1000:>10.1f}")
+
+
+def regressions(report, baseline, tolerance, slack):
+    found = []
+    for name, expected in baseline['bots'].items():
+        result = report['bots'].get(name)
+        if result is None:
+            continue
+        if result['throughput'] < expected['throughput'] * (1 - tolerance):
+            found.append(f"{name}: throughput {result['throughput']:.1f}/s < baseline {expected['throughput']:.1f}/s")
+        if result['timeouts'] > expected['timeouts']:
+            found.append(f"{name}: {result['timeouts']} timeouts, baseline {expected['timeouts']}")
+        for path, limits in expected['paths'].items():
+            current = result['paths'].get(path)
+            if current is None:
+                continue
+            for key in ('p95', 'p99'):
+                if current[key] > limits[key] * (1 + tolerance) + slack:
+                    found.append(f"{name}/{path}: {key} {current[key] * 1000:.1f} ms > "
+                                 f"baseline {limits[key] * 1000:.1f} ms")
+    return found
+
+# The options a single run needs, for re-running this benchmark in a child process
+def run_argv(args):
+    argv = ["--bot", args.bot, "--corpus", args.corpus, "--fixtures", args.fixtures, "--timeout", str(args.timeout)]
+    for key, value in settings(args).items():
+        flag = "--" + key.replace("_", "-")
+        if isinstance(value, bool):
+            argv += [flag] if value else []
+        else:
+            argv += [flag, str(value)]
+    return argv
+
+def fresh_report(args):
+    # No baseline for the child to compare with; it only writes its report
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, "report.json")
+        subprocess.run([sys.executable, os.path.join(BENCH_DIR, "run.py")] + run_argv(args) +
+                       ["--baseline", os.path.join(directory, "none.json"), "--output", output],
+                       check=False, stdout=subprocess.DEVNULL)
+        with open(output) as f:
+            return json.load(f)
+
+# Slowest p50/p95/p99/max and lowest throughput seen per bot and path
+def worst_of(reports):
+    worst = json.loads(json.dumps(reports[0]))
+    for report in reports[1:]:
+        for name, result in report['bots'].items():
+            merged = worst['bots'][name]
+            merged['throughput'] = min(merged['throughput'], result['throughput'])
+            merged['timeouts'] = max(merged['timeouts'], result['timeouts'])
+            for path, current in result['paths'].items():
+                limits = merged['paths'].setdefault(path, dict(current))
+                for key in ('p50', 'p95', 'p99', 'max'):
+                    limits[key] = max(limits[key], current[key])
+    return worst
+
+def baseline_view(report):
+    return {
+        'settings': report['settings'],
+        'bots': {name: {key: result[key] for key in ('throughput', 'timeouts', 'paths')}
+                 for name, result in report['bots'].items()},
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    baseline_path = os.path.abspath(args.baseline)
+    output_path = os.path.abspath(args.output) if args.output else None
+    args.corpus = os.path.abspath(args.corpus)
+    args.fixtures = os.path.abspath(args.fixtures)
+    with open(args.fixtures, encoding='utf-8') as f:
+        fixtures = json.load(f)
+    with open(args.corpus, encoding='utf-8') as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    line, ollama = install_fakes(args, fixtures)
+    report = {'settings': settings(args), 'bots': {}}
+    for name in (BOTS if args.bot == "both" else [args.bot]):
+        report['bots'][name] = bench_bot(name, args, line, fixtures, corpus)
+    report['ollama_generations'] = ollama.requests
+    print_report(report)
+
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.save_baseline:
+        reports = [report] + [fresh_report(args) for _ in range(args.baseline_runs - 1)]
+        with open(baseline_path, 'w') as f:
+            json.dump(baseline_view(worst_of(reports)), f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"\nBaseline written to {baseline_path}")
+        return 0
+    if not os.path.exists(baseline_path):
+        print(f"\nNo baseline at {baseline_path}; record one with --save-baseline")
+        return 2
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if baseline['settings'] != report['settings']:
+        print("\nBaseline was recorded with different settings:", baseline['settings'])
+        return 2
+    missing = [name for name in report['bots'] if name not in baseline['bots']]
+    if missing:
+        print("\nBaseline has no results for:", ", ".join(missing))
+        return 2
+    found = regressions(report, baseline, args.tolerance, args.slack)
+    for regression in found:
+        print("REGRESSION", regression)
+    if not found:
+        print("\nNo regressions against the baseline")
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
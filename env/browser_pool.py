@@ -0,0 +1,126 @@
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from selenium import webdriver
+import chromedriver_autoinstaller
+
+BROWSER_POOL_SIZE = int(os.environ.get("BROWSER_POOL_SIZE", "2"))
+
+_driver_installed = False
+_install_lock = threading.Lock()
+
+
+# Installing chromedriver is deferred until the first browser is started
+def install_driver():
+    global _driver_installed
+    if not _driver_installed:
+        with _install_lock:
+            if not _driver_installed:
+                chromedriver_autoinstaller.install()
+                _driver_installed = True
+
+
+def chrome_options():
+    options = webdriver.ChromeOptions()
+    options.add_argument('--headless')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    options.add_argument('--blink-settings=imagesEnabled=false')
+    return options
+
+
+class PooledDriver:
+    def __init__(self, driver):
+        self.driver = driver
+        self.created = time.monotonic()
+        self.uses = 0
+
+
+# Warm headless Chrome instances reused across searches. Drivers are health
+# checked on checkout and recycled after max_uses page loads or max_age seconds.
+class DriverPool:
+    def __init__(self, size=BROWSER_POOL_SIZE, max_uses=100, max_age=1800, acquire_timeout=30,
+                 page_load_timeout=20, options=chrome_options):
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self.acquire_timeout = acquire_timeout
+        self.page_load_timeout = page_load_timeout
+        self.options = options
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.created = 0
+        self.recycled = 0
+
+    def _create(self):
+        install_driver()
+        driver = webdriver.Chrome(options=self.options())
+        driver.set_page_load_timeout(self.page_load_timeout)
+        self.created += 1
+        return PooledDriver(driver)
+
+    def _expired(self, entry):
+        return entry.uses >= self.max_uses or time.monotonic() - entry.created > self.max_age
+
+    def _healthy(self, entry):
+        if self._expired(entry):
+            return False
+        try:
+            entry.driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def _quit(self, entry):
+        self.recycled += 1
+        try:
+            entry.driver.quit()
+        except Exception:
+            pass
+
+    def _checkout(self):
+        while True:
+            try:
+                entry = self.idle.get_nowait()
+            except queue.Empty:
+                return self._create()
+            if self._healthy(entry):
+                return entry
+            self._quit(entry)
+
+    @contextmanager
+    def driver(self):
+        if not self.slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError("No browser available in the pool")
+        entry = None
+        try:
+            entry = self._checkout()
+            yield entry.driver
+        except Exception:
+            # The driver may be in an unknown state after a failed page load
+            if entry is not None:
+                self._quit(entry)
+            raise
+        else:
+            entry.uses += 1
+            if self._expired(entry):
+                self._quit(entry)
+            else:
+                self.idle.put(entry)
+        finally:
+            self.slots.release()
+
+    def warm(self, count=1):
+        for _ in range(count):
+            self.idle.put(self._create())
+
+    def close(self):
+        while True:
+            try:
+                self._quit(self.idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def stats(self):
+        return {'idle': self.idle.qsize(), 'created': self.created, 'recycled': self.recycled}
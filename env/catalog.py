@@ -0,0 +1,166 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from product_search import normalize_term
+
+CATALOG_PATH = os.environ.get("CATALOG_PATH", "catalog.sqlite3")
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS products (
+    link TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    norm_title TEXT NOT NULL,
+    price REAL,
+    price_text TEXT NOT NULL,
+    crawled_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS products_price ON products (price);
+CREATE TABLE IF NOT EXISTS title_tokens (
+    token TEXT NOT NULL,
+    link TEXT NOT NULL,
+    PRIMARY KEY (token, link)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS search_terms (
+    term TEXT PRIMARY KEY,
+    crawled_at REAL NOT NULL,
+    product_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS term_products (
+    term TEXT NOT NULL,
+    link TEXT NOT NULL,
+    PRIMARY KEY (term, link)
+) WITHOUT ROWID;
+'''
+
+
+def parse_price(price_text):
+    price_text = price_text.replace('฿', '').replace('บาท', '').replace(',', '').strip()
+    # A price range such as "120-150" is stored as its lower bound
+    match = re.search(r'\d+(?:\.\d+)?', price_text)
+    return float(match.group()) if match else None
+
+
+# Titles are Thai without word breaks, so the token index uses character
+# trigrams of the title with whitespace removed.
+def title_tokens(text):
+    text = "".join(text.split()).lower()
+    if len(text) < 3:
+        return {text} if text else set()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# Local snapshot of the bakeryclick catalog with a trigram index over titles
+# and a price index, so term + max price lookups never touch the website.
+class ProductCatalog:
+    def __init__(self, path=CATALOG_PATH):
+        self.path = path
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.local.db = db
+        return db
+
+    def store(self, search_term, results):
+        term = normalize_term(search_term)
+        now = time.time()
+        with self.write_lock, self._connect() as db:
+            db.execute('DELETE FROM term_products WHERE term = ?', (term,))
+            for item in results:
+                if item['link'] == "Link not available":
+                    continue
+                price = parse_price(item['price']) if item['price'] != "Price not available" else None
+                db.execute('INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?, ?)',
+                           (item['link'], item['title'], "".join(item['title'].split()).lower(),
+                            price, item['price'], now))
+                db.execute('DELETE FROM title_tokens WHERE link = ?', (item['link'],))
+                db.executemany('INSERT INTO title_tokens VALUES (?, ?)',
+                               [(token, item['link']) for token in title_tokens(item['title'])])
+                db.execute('INSERT OR IGNORE INTO term_products VALUES (?, ?)', (term, item['link']))
+            db.execute('INSERT OR REPLACE INTO search_terms VALUES (?, ?, ?)', (term, now, len(results)))
+
+    def known_terms(self):
+        return [row['term'] for row in self._connect().execute('SELECT term FROM search_terms ORDER BY crawled_at')]
+
+    def has_term(self, search_term):
+        row = self._connect().execute('SELECT 1 FROM search_terms WHERE term = ?', (normalize_term(search_term),))
+        return row.fetchone() is not None
+
+    # Returns None when the term has never been crawled (the caller should
+    # fall back to a live search, which stores it), otherwise the cheapest
+    # matching products. The title index only adds to the results of a
+    # crawled term; partial matches from other terms' snapshots are not an
+    # answer for a term of their own.
+    def search(self, search_term, max_price=None, limit=5):
+        term = normalize_term(search_term)
+        if not self.has_term(term):
+            return None
+        db = self._connect()
+        tokens = title_tokens(term)
+        params = [term]
+        token_match = ''
+        if tokens:
+            token_match = '''
+                OR p.link IN (
+                    SELECT link FROM title_tokens WHERE token IN ({})
+                    GROUP BY link HAVING COUNT(*) = ?
+                ) AND instr(p.norm_title, ?) > 0
+            '''.format(', '.join('?' * len(tokens)))
+            params += list(tokens) + [len(tokens), "".join(term.split())]
+        query = f'''
+            SELECT p.title, p.price_text, p.link FROM products p
+            WHERE p.price IS NOT NULL
+              AND (p.link IN (SELECT link FROM term_products WHERE term = ?) {token_match})
+        '''
+        if max_price is not None:
+            query += ' AND p.price < ?'
+            params.append(max_price)
+        query += ' ORDER BY p.price LIMIT ?'
+        params.append(limit)
+        rows = db.execute(query, params).fetchall()
+        return [{'title': row['title'], 'price': row['price_text'], 'link': row['link']} for row in rows]
+
+
+# Background thread that periodically re-crawls every known search term (plus
+# the seed terms) and stores the snapshot in the catalog.
+class CatalogCrawler:
+    def __init__(self, catalog, fetch, seed_terms=(), interval=6 * 3600, pause=2.0):
+        self.catalog = catalog
+        self.fetch = fetch
+        self.seed_terms = [normalize_term(term) for term in seed_terms]
+        self.interval = interval
+        self.pause = pause
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="catalog-crawler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def crawl(self, search_term):
+        try:
+            self.catalog.store(search_term, self.fetch(search_term) or [])
+        except Exception as e:
+            print(f"Catalog crawl failed for {search_term}: {e}")
+
+    def _run(self):
+        while not self.stopped.is_set():
+            known = self.catalog.known_terms()
+            for term in self.seed_terms + [t for t in known if t not in self.seed_terms]:
+                if self.stopped.is_set():
+                    return
+                self.crawl(term)
+                self.stopped.wait(self.pause)
+            self.stopped.wait(self.interval)
@@ -1,115 +1,123 @@
-from neo4j import GraphDatabase
-from flask import Flask, request, jsonify
-from linebot import LineBotApi, WebhookHandler
+from flask import Flask, Response, request, jsonify
+from linebot import WebhookHandler
 from linebot.exceptions import InvalidSignatureError
 from linebot.models import TextSendMessage, QuickReply, QuickReplyButton, MessageAction
-from sentence_transformers import SentenceTransformer, util
-import numpy as np
-import requests
 import json
+from embedding_index import EmbeddingIndex, IndexSync
+from encoder import ENCODER_BACKEND
+from embedding_service import encode
+import embedding_service
+from graph_db import read_query, query_stats
+from write_behind import WriteBehindQueue
+from answer_cache import SemanticCache
+from ollama_client import OLLAMA_ANSWER_TOKENS, OllamaClient, OllamaError
+from webhook_pipeline import EventDispatcher
+from intent_router import Intent, IntentRouter
+from line_reply import Reply, create_line_bot_api
+from reply_scheduler import ReplyScheduler
+from lanes import create_lanes
+from schema import ensure_schema
+import metrics
+from compaction import CompactionJob
 
 # OLLAMA API settings
-OLLAMA_API_URL = "http://localhost:11434/api/generate"
-headers = {
-    "Content-Type": "application/json"
-}
+ollama = OllamaClient(model="supachai/llama-3-typhoon-v1.5")
+
+GREETING_INDEX_PATH = f"question_index_{ENCODER_BACKEND}.npz"
+
+# Graph writes that are not needed for the reply are flushed in the background
+persistence = WriteBehindQueue()
+
+# Earlier Ollama answers, reused for messages that are close enough in meaning
+answer_cache = SemanticCache(threshold=0.9, ttl=6 * 3600, max_size=4096)
 
-model = SentenceTransformer('sentence-transformers/distiluse-base-multilingual-cased-v2')
-URI = "bolt://localhost:7687"
-AUTH = ("neo4j", "test")
+# Slow paths run on their own lanes; answers slower than their budget are
+# acknowledged first and pushed later
+scheduler = ReplyScheduler(lanes=create_lanes(['fast', 'llm']))
+ACK_TEXT = "ขอเวลาสักครู่นะครับ กำลังหาคำตอบให้"
 
-def run_query(query, parameters=None):
-    with GraphDatabase.driver(URI, auth=AUTH) as driver:
-        driver.verify_connectivity()
-        with driver.session() as session:
-            result = session.run(query, parameters)
-            return [record for record in result]
+USER_NAME_QUERY = '''
+MATCH (u:User {uid: $uid})
+RETURN u.name AS name
+'''
+
+PREVIOUS_ANSWER_QUERY = '''
+MATCH (q:Question {text: $question})-[:HAS_ANSWER]->(a:Answer)
+RETURN a.text AS answer
+LIMIT 1
+'''
 
 def save_user_info(uid, name):
-    query = '''
-    MERGE (u:User {uid: $uid})
-    SET u.name = $name
-    '''
-    run_query(query, parameters={'uid': uid, 'name': name})
+    # Written through: the user's next message may ask for the name
+    persistence.write_now('save_user_info', uid=uid, name=name)
 
 def get_user_name(uid):
-    query = '''
-    MATCH (u:User {uid: $uid})
-    RETURN u.name AS name
-    '''
-    result = run_query(query, parameters={'uid': uid})
+    result = read_query(USER_NAME_QUERY, parameters={'uid': uid})
     return result[0]['name'] if result else None
 
-def compute_response(sentence):
+greeting_index = EmbeddingIndex(encode, path=GREETING_INDEX_PATH, identity=embedding_service.encoder_name)
+
+def greeting_corpus():
+    records = read_query('MATCH (n:Question) WHERE n.question IS NOT NULL RETURN n.question AS question, n.msg_reply AS reply;')
+    return {record['question']: record['reply'] for record in records}
+
+# The index file is loaded at startup and kept in line with Neo4j by a
+# background sync that only encodes new texts
+greeting_sync = IndexSync(greeting_index, greeting_corpus)
+
+# The bot still starts when Neo4j is unreachable: it answers from the saved
+# index, and the background sync catches up once the database is back
+def load_greeting_index():
+    greeting_index.load()
+    try:
+        greeting_sync.sync()
+    except Exception as e:
+        print("Greeting index sync failed at startup:", e)
+
+def compute_response(sentence, ask_vec=None):
     if not sentence.strip():
         return None
 
-    greeting_corpus = list(set(record['question'] for record in run_query('MATCH (n:Question) RETURN n.question as question;')))
-    
-    if not greeting_corpus:
+    if not len(greeting_index):
         print("Greeting corpus is empty")
         return None
 
-    greeting_vec = model.encode(greeting_corpus, convert_to_tensor=True, normalize_embeddings=True)
-    ask_vec = model.encode(sentence, convert_to_tensor=True, normalize_embeddings=True)
+    if ask_vec is None:
+        ask_vec = encode([sentence])[0]
 
-    greeting_scores = util.cos_sim(greeting_vec, ask_vec)
-    max_greeting_score_index = np.argmax(greeting_scores.cpu().numpy())
-    if greeting_scores[max_greeting_score_index] > 0.8:
-        match_greeting = greeting_corpus[max_greeting_score_index]
-        my_cypher = f"MATCH (n:Question) WHERE n.question = '{match_greeting}' RETURN n.msg_reply AS reply"
-        results = run_query(my_cypher)
-        return results[0]['reply'] if results else None
+    with metrics.span('compute_response'):
+        matches = greeting_index.search(ask_vec)
+    if matches and matches[0][2] > 0.8:
+        return matches[0][1]
 
     return None
 
 def log_question_answer(question, answer):
-    cypher_query = '''
-    MATCH (q:Question {text: $question}) 
-    MATCH (a:Answer {text: $answer}) 
-    MERGE (q)-[:HAS_ANSWER]->(a)
-    '''
-    run_query(cypher_query, parameters={"question": question, "answer": answer})
+    persistence.put('log_question_answer', question=question, answer=answer)
 
 def check_previous_question(question):
-    cypher_query = '''
-    MATCH (q:Question {text: $question}) 
-    MATCH (a:Answer) 
-    RETURN a.text AS answer
-    '''
-    result = run_query(cypher_query, parameters={"question": question})
+    result = read_query(PREVIOUS_ANSWER_QUERY, parameters={"question": question})
     return result[0]['answer'] if result else None
 
-def is_similar_query(user_query, expected_queries):
-    user_vec = model.encode(user_query, convert_to_tensor=True, normalize_embeddings=True)
-    for expected in expected_queries:
-        expected_vec = model.encode(expected, convert_to_tensor=True, normalize_embeddings=True)
-        score = util.cos_sim(user_vec, expected_vec)
-        if score > 0.7:
-            return True
-    return False
-
-def remove_endings(text):
-    endings = ["ครับ", "ค่ะ", "น้ะ", "นะ", "นะจ้ะ"]
-    for ending in endings:
-        text = text.replace(ending, "")
-    return text.strip()
+# Rule-based intents, answered without touching the embedding model or Ollama
+INTENTS = [
+    Intent('ask_name', all_of=["ชื่อ", "อะไร"]),
+    Intent('tell_name', any_of=["ชื่อ"]),
+    Intent('menu', exact=["เมนู", "menu", "Menu"]),
+]
+router = IntentRouter(INTENTS)
 
 def save_response(uid, answer_text, response_msg):
-    query = '''
-    MATCH (u:User {uid: $uid})
-    CREATE (a:Answer {text: $answer_text})
-    CREATE (r:Response {text: $response_msg})
-    CREATE (u)-[:useranswer]->(a)
-    CREATE (a)-[:response]->(r)
-    '''
-    parameters = {
-        'uid': uid,
-        'answer_text': answer_text,
-        'response_msg': response_msg
-    }
-    run_query(query, parameters)
-    
+    persistence.put('save_response', uid=uid, answer_text=answer_text, response_msg=response_msg)
+
+ensure_schema()
+load_greeting_index()
+greeting_sync.start()
+
+# Merges duplicate history nodes and rolls up old chats in the background; a
+# file lock keeps the two bots from compacting at the same time
+compaction = CompactionJob()
+compaction.start()
 
 app = Flask(__name__)
 
@@ -118,79 +126,103 @@ with open('usr_champ.txt', 'r') as file:
     channel_access_token = lines[0].strip()
     channel_secret = lines[1].strip()
 
-line_bot_api = LineBotApi(channel_access_token)
+line_bot_api = create_line_bot_api(channel_access_token)
 handler = WebhookHandler(channel_secret)
 
 # ---- From Second Code: Quick Reply Functions -----
 
-def quick_reply_menu(line_bot_api, tk, user_id, msg):
+def quick_reply_menu(reply, user_id, msg):
     quick_reply_button = QuickReplyButton(
         action=MessageAction(label="เมนู", text="เมนู")
     )
     quick_reply = QuickReply(
         items=[quick_reply_button]
     )
-    line_bot_api.reply_message(tk, [TextSendMessage(text="เลือกเมนูที่ต้องการ", quick_reply=quick_reply)])
+    reply.add(TextSendMessage(text="เลือกเมนูที่ต้องการ", quick_reply=quick_reply))
 
 # ---- End of Quick Reply ----
 
+def respond(reply, msg, uid):
+    with metrics.span('intents'):
+        msg = router.clean(msg)
+        intents = router.match(msg)
+
+    if 'ask_name' in intents:
+        user_name = get_user_name(uid)
+        if user_name:
+            reply.add(TextSendMessage(text=f"ชื่อของคุณคือ {user_name} ครับ"))
+        else:
+            reply.add(TextSendMessage(text="ขอโทษครับ ฉันไม่ทราบชื่อของคุณ"))
+
+    elif 'tell_name' in intents:
+        name = msg.split("ชื่อ")[-1].strip()
+        if name:
+            save_user_info(uid, name)
+            reply.add(TextSendMessage(text=f"ขอบคุณที่แนะนำตัวครับ {name}"))
+        else:
+            reply.add(TextSendMessage(text="ไม่สามารถระบุชื่อได้ กรุณาระบุชื่อของคุณครับ"))
+
+    # Check for quick reply menu request
+    if 'menu' in intents:
+        quick_reply_menu(reply, uid, msg)
+
+    if intents:
+        return
+
+    scheduler.run(reply, 'compute_response', lambda: answer(reply, msg, uid), ack=ACK_TEXT)
+
+def answer(reply, msg, uid):
+    ask_vec = encode([msg])[0]
+    response_msg = compute_response(msg, ask_vec)
+
+    if response_msg:
+        reply.add(TextSendMessage(text=response_msg + " ครับ"))
+        save_response(uid, msg, response_msg)  # บันทึกคำตอบ
+    # An answer stored for this exact question wins over a cached answer to
+    # a similar one; Ollama is the last resort
+    elif (previous_answer := check_previous_question(msg)):
+        reply.add(TextSendMessage(text=previous_answer + " ครับ"))
+        answer_cache.put(ask_vec, previous_answer)
+    elif (cached_answer := answer_cache.lookup(ask_vec)) is not None:
+        reply.add(TextSendMessage(text=cached_answer + " ครับ"))
+        save_response(uid, msg, cached_answer)
+    else:
+        # No per-user text in the prompt: identical questions share one
+        # generation and the answer can be cached for everyone
+        prompt = f"ตอบสั้นๆไม่เกิน 20 คำ เกี่ยวกับ '{msg}'"
+        scheduler.run(reply, 'ollama', lambda: ask_ollama(reply, msg, uid, prompt, ask_vec), ack=ACK_TEXT)
+
+def ask_ollama(reply, msg, uid, prompt, ask_vec):
+    try:
+        decoded_text = ollama.generate(prompt, max_tokens=OLLAMA_ANSWER_TOKENS)
+        reply.add(TextSendMessage(text=decoded_text + " ครับ\n.....คำตอบจาก Ollama..."))
+        answer_cache.put(ask_vec, decoded_text)
+        log_question_answer(msg, decoded_text)
+        save_response(uid, msg, decoded_text)  # บันทึกคำตอบ
+    except OllamaError as e:
+        print(f"Failed to get a response from Ollama: {e}")
+        reply.add(TextSendMessage(text="เกิดข้อผิดพลาดในการติดต่อ LLaMA"))
+
+def handle_event(event):
+    if event.get('type') != 'message' or event['message'].get('type') != 'text':
+        return
+    # Everything respond() adds goes out in one reply_message call
+    reply = Reply(line_bot_api, event)
+    scheduler.handle(reply, respond, event['message']['text'], event['source']['userId'])
+
+dispatcher = EventDispatcher(handle_event)
+
+# Verify the signature, queue every event in the batch and acknowledge at once
 @app.route("/", methods=['POST'])
 def linebot():
     body = request.get_data(as_text=True)
     try:
-        json_data = json.loads(body)
         signature = request.headers['X-Line-Signature']
-        handler.handle(body, signature)
-
-        msg = json_data['events'][0]['message']['text']
-        tk = json_data['events'][0]['replyToken']
-        uid = json_data['events'][0]['source']['userId']
-
-        msg = remove_endings(msg)
-
-        if "ชื่อ" in msg and "อะไร" in msg:
-            user_name = get_user_name(uid)
-            if user_name:
-                line_bot_api.reply_message(tk, TextSendMessage(text=f"ชื่อของคุณคือ {user_name} ครับ"))
-            else:
-                line_bot_api.reply_message(tk, TextSendMessage(text="ขอโทษครับ ฉันไม่ทราบชื่อของคุณ"))
-
-        elif "ชื่อ" in msg:
-            name = msg.split("ชื่อ")[-1].strip()
-            if name:
-                save_user_info(uid, name)
-                line_bot_api.reply_message(tk, TextSendMessage(text=f"ขอบคุณที่แนะนำตัวครับ {name}"))
-            else:
-                line_bot_api.reply_message(tk, TextSendMessage(text="ไม่สามารถระบุชื่อได้ กรุณาระบุชื่อของคุณครับ"))
-
-        # Check for quick reply menu request
-        if msg in ["เมนู", "menu", "Menu"]:
-            quick_reply_menu(line_bot_api, tk, uid, msg)
-
-        response_msg = compute_response(msg)
-
-        if response_msg:
-            line_bot_api.reply_message(tk, TextSendMessage(text=response_msg + " ครับ"))
-            save_response(uid, msg, response_msg)  # บันทึกคำตอบ
-        else:
-            previous_answer = check_previous_question(msg)
-            if previous_answer:
-                line_bot_api.reply_message(tk, TextSendMessage(text=previous_answer + " ครับ"))
-            else:
-                payload = {
-                    "model": "supachai/llama-3-typhoon-v1.5",
-                    "prompt": f"ผู้ถามชื่อ คุณ{get_user_name(uid)} ตอบสั้นๆไม่เกิน 20 คำ เกี่ยวกับ '{msg}'",
-                    "stream": False
-                }
-                response = requests.post(OLLAMA_API_URL, headers=headers, data=json.dumps(payload))
-                if response.status_code == 200:
-                    decoded_text = response.json().get("response", "")
-                    line_bot_api.reply_message(tk, TextSendMessage(text=decoded_text + " ครับ\n.....คำตอบจาก Ollama..."))
-                    log_question_answer(msg, decoded_text)
-                    save_response(uid, msg, decoded_text)  # บันทึกคำตอบ
-                else:
-                    print(f"Failed to get a response from Ollama: {response.status_code}, {response.text}")
-                    line_bot_api.reply_message(tk, TextSendMessage(text="เกิดข้อผิดพลาดในการติดต่อ LLaMA"))
+        with metrics.span('webhook'):
+            handler.handle(body, signature)
+
+            for event in json.loads(body)['events']:
+                dispatcher.submit(event)
 
     except InvalidSignatureError:
         print("Invalid signature.")
@@ -200,5 +232,31 @@ def linebot():
     return 'OK'
 
 
+# Component stats, served as JSON on /stats and as gauges on /metrics
+component_stats = {
+    'webhook': dispatcher.stats,
+    'neo4j': query_stats,
+    'write_behind': persistence.stats,
+    'answer_cache': answer_cache.stats,
+    'ollama': ollama.stats,
+    'embedding': embedding_service.stats,
+    'reply_scheduler': scheduler.stats,
+    'compaction': compaction.stats,
+    'greeting_index': greeting_sync.stats,
+    'lane_fast': scheduler.lanes['fast'].stats,
+    'lane_llm': scheduler.lanes['llm'].stats,
+}
+for name, component in component_stats.items():
+    metrics.register_stats(name, component)
+
+@app.route("/stats", methods=['GET'])
+def stats():
+    return jsonify({name: component() for name, component in component_stats.items()})
+
+@app.route("/metrics", methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 if __name__ == "__main__":
     app.run(port=5000)
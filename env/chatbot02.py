@@ -1,286 +1,367 @@
-from neo4j import GraphDatabase
-from flask import Flask, request, jsonify
-from linebot import LineBotApi
+from flask import Flask, Response, request, jsonify
 from linebot.v3.webhook import WebhookHandler
 from linebot.exceptions import InvalidSignatureError
 from linebot.models import MessageEvent, TextMessage, TextSendMessage, QuickReply, QuickReplyButton, MessageAction
-from sentence_transformers import SentenceTransformer, util
-import numpy as np
-import requests
 import json
-from bs4 import BeautifulSoup
 import re
-from selenium import webdriver
-import chromedriver_autoinstaller
-
-# Setup Chrome options and install chromedriver
-chrome_options = webdriver.ChromeOptions()
-chrome_options.add_argument('--headless')
-chrome_options.add_argument('--no-sandbox')
-chrome_options.add_argument('--disable-dev-shm-usage')
-chromedriver_autoinstaller.install()
+import atexit
+import threading
+from embedding_index import EmbeddingIndex, IndexSync
+from encoder import ENCODER_BACKEND
+from embedding_service import encode
+import embedding_service
+from graph_db import read_query, read_queries, query_stats
+from write_behind import WriteBehindQueue
+from answer_cache import SemanticCache
+from ollama_client import OLLAMA_ANSWER_TOKENS, OllamaClient, OllamaError
+from browser_pool import DriverPool
+from product_search import ProductSearch
+from catalog import ProductCatalog, CatalogCrawler
+from webhook_pipeline import EventDispatcher
+from session_store import SessionStore, default_backend
+from intent_router import Intent, IntentRouter
+from line_reply import Reply, create_line_bot_api
+from reply_scheduler import ReplyScheduler
+from schema import ensure_schema
+import metrics
+from compaction import CompactionJob
+import time
 
 # Constants
-OLLAMA_API_URL = "http://localhost:11434/api/generate"
-headers = {"Content-Type": "application/json"}
-model = SentenceTransformer('sentence-transformers/distiluse-base-multilingual-cased-v2')
-URI = "bolt://localhost:7687"
-AUTH = ("neo4j", "test")
+ollama = OllamaClient(model="supachai/llama-3-typhoon-v1.5")
+GREETING_INDEX_PATH = f"greeting_index_{ENCODER_BACKEND}.npz"
+persistence = WriteBehindQueue()
+# Search state per LINE user (search term, price limit); set SESSION_DB to
+# share it between worker processes
+sessions = SessionStore(ttl=1800, backend=default_backend())
+answer_cache = SemanticCache(threshold=0.9, ttl=6 * 3600, max_size=4096)
+
+# Embedding answers, Ollama and product scrapes run on separate lanes; work
+# slower than its budget is acknowledged first and pushed later
+scheduler = ReplyScheduler()
+ACK_TEXT = "ขอเวลาสักครู่นะคะ กำลังหาคำตอบให้"
+SEARCH_ACK_TEXT = "กำลังค้นหาสินค้าให้อยู่นะคะ สักครู่ค่ะ"
 
 # Database query functions
-def run_query(query, parameters=None):
-    with GraphDatabase.driver(URI, auth=AUTH) as driver:
-        driver.verify_connectivity()
-        with driver.session() as session:
-            return [record for record in session.run(query, parameters)]
+USER_NAME_QUERY = '''
+MATCH (u:User {uid: $uid})
+RETURN u.name AS name
+'''
+PREVIOUS_ANSWER_QUERY = 'MATCH (q:Question {text: $question})-[:HAS_ANSWER]->(a:Answer) RETURN a.text AS answer LIMIT 1'
 
 def save_user_info(uid, name):
-    run_query('MERGE (u:User {uid: $uid}) SET u.name = $name', {'uid': uid, 'name': name})
+    # Written through: the user's next message may ask for the name
+    persistence.write_now('save_user_info', uid=uid, name=name)
 
 
 def get_user_name(uid):
-    query = '''
-    MATCH (u:User {uid: $uid})
-    RETURN u.name AS name
-    '''
-    result = run_query(query, parameters={'uid': uid})
+    result = read_query(USER_NAME_QUERY, parameters={'uid': uid})
     return result[0]['name'] if result else None
 
+# User name and previously stored answer fetched in a single transaction
+def get_user_context(uid, question):
+    names, answers = read_queries((USER_NAME_QUERY, {'uid': uid}), (PREVIOUS_ANSWER_QUERY, {'question': question}))
+    return (names[0]['name'] if names else None, answers[0]['answer'] if answers else None)
+
 def log_chat_history(uid, message, reply):
-    run_query('MATCH (u:User {uid: $uid}) CREATE (c:Chat {message: $message, reply: $reply, timestamp: timestamp()}) CREATE (u)-[:SENT]->(c)', {'uid': uid, 'message': message, 'reply': reply})
+    persistence.put('log_chat_history', uid=uid, message=message, reply=reply, timestamp=int(time.time() * 1000))
 
 def save_response(uid, answer_text, response_msg):
-    run_query('MATCH (u:User {uid: $uid}) CREATE (a:Answer {text: $answer_text}) CREATE (r:Response {text: $response_msg}) CREATE (u)-[:useranswer]->(a) CREATE (a)-[:response]->(r)', {'uid': uid, 'answer_text': answer_text, 'response_msg': response_msg})
+    persistence.put('save_response', uid=uid, answer_text=answer_text, response_msg=response_msg)
+
 def clean_price(price_str):
     cleaned_price = re.sub(r'[^\d]', '', price_str)
     return int(cleaned_price)
 
 
-def compute_response(sentence):
-    greeting_corpus = list(set(record['name'] for record in run_query('MATCH (n:Greeting) RETURN n.name as name;')))
-    greeting_vec = model.encode(greeting_corpus, convert_to_tensor=True, normalize_embeddings=True)
-    ask_vec = model.encode(sentence, convert_to_tensor=True, normalize_embeddings=True)
-    greeting_scores = util.cos_sim(greeting_vec, ask_vec)
-    
-    if (max_index := np.argmax(greeting_scores.cpu().numpy())) and greeting_scores[max_index] > 0.6:
-        match_greeting = greeting_corpus[max_index]
-        results = run_query(f"MATCH (n:Greeting) WHERE n.name = '{match_greeting}' RETURN n.msg_reply AS reply")
-        return results[0]['reply'] if results else None
+greeting_index = EmbeddingIndex(encode, path=GREETING_INDEX_PATH, identity=embedding_service.encoder_name)
+
+def greeting_corpus():
+    records = read_query('MATCH (n:Greeting) WHERE n.name IS NOT NULL RETURN n.name AS name, n.msg_reply AS reply;')
+    return {record['name']: record['reply'] for record in records}
+
+# The index file is loaded at startup and kept in line with Neo4j by a
+# background sync that only encodes new texts
+greeting_sync = IndexSync(greeting_index, greeting_corpus)
+
+# The bot still starts when Neo4j is unreachable: it answers from the saved
+# index, and the background sync catches up once the database is back
+def load_greeting_index():
+    greeting_index.load()
+    try:
+        greeting_sync.sync()
+    except Exception as e:
+        print("Greeting index sync failed at startup:", e)
+
+def compute_response(sentence, ask_vec=None):
+    if ask_vec is None:
+        ask_vec = encode([sentence])[0]
+    with metrics.span('compute_response'):
+        matches = greeting_index.search(ask_vec)
+    if matches and matches[0][2] > 0.6:
+        return matches[0][1]
     return None
 
-def check_previous_question(question):
-    result = run_query('MATCH (q:Question {text: $question})-[:HAS_ANSWER]->(a:Answer) RETURN a.text AS answer', {"question": question})
-    return result[0]['answer'] if result else None
-
-def is_similar_query(user_query, expected_queries):
-    user_vec = model.encode(user_query, convert_to_tensor=True, normalize_embeddings=True)
-    return any(util.cos_sim(user_vec, model.encode(expected, convert_to_tensor=True, normalize_embeddings=True)) > 0.7 for expected in expected_queries)
-
-def remove_endings(text):
-    endings = ["ครับ", "ค่ะ", "น้ะ", "นะ", "นะจ้ะ"]
-    for ending in endings:
-        text = text.replace(ending, "")
-    return text.strip()
-
-def fetch_product_info(search_term):
-    chrome_options = webdriver.ChromeOptions()
-    chrome_options.add_argument('--headless')  # Run in headless mode if desired
-
-    with webdriver.Chrome(options=chrome_options) as driver:
-        driver.get(f"https://www.bakeryclick.com/search?q={search_term}")
-        driver.implicitly_wait(10)
-        html = driver.page_source
-
-    results = []
-    mysoup = BeautifulSoup(html, "html.parser")
-    
-    product_cards = mysoup.find_all("div", class_="product_name")
-
-    for card in product_cards:
-        # Extract product title
-        title_text = card.get_text(strip=True)
-
-        # Extract product link
-        link_element = card.find("a")
-        link = f"https://www.bakeryclick.com{link_element['href']}" if link_element else "Link not available"
-
-        # Extract additional product data from the gaeepd attribute
-        gaeepd_data = link_element.get('gaeepd')
-        product_info = json.loads(gaeepd_data.replace('&quot;', '"')) if gaeepd_data else {}
-
-        # Extract product price
-        price_text = product_info.get("price", "Price not available")
-        price_text = f"{price_text} บาท" if price_text != "Price not available" else price_text
-
-        # Append the product details to the results list
-        results.append({
-            'title': title_text,
-            'price': price_text,
-            'link': link
-        })
-
-    # Return a maximum of 5 results
+# Keyword intents are matched in one pass over the message; ask_name also has
+# prototype phrases that are compared with the message embedding
+INTENTS = [
+    Intent('menu', any_of=["เมนู"]),
+    Intent('search', any_of=["ค้นหา"]),
+    Intent('price_limit', any_of=["ไม่เกิน"]),
+    Intent('show_all', any_of=["All"]),
+    Intent('ask_name', all_of=["ชื่อ", "อะไร"], prototypes=["ชื่ออะไร", "ผมชื่ออะไร", "ชื่อของฉัน"], threshold=0.7),
+    Intent('tell_name', any_of=["ชื่อ"], none_of=["เชื่อ"]),
+]
+router = IntentRouter(INTENTS, encode=encode)
+
+# Warm headless browsers and a per-term result cache for product searches
+browser_pool = DriverPool()
+product_search = ProductSearch(browser_pool, ttl=600)
+atexit.register(browser_pool.close)
+threading.Thread(target=browser_pool.warm, daemon=True).start()
+
+# Local catalog snapshot, refreshed in the background; live scraping is only
+# needed the first time a term is searched
+catalog = ProductCatalog()
+catalog_crawler = CatalogCrawler(catalog, product_search.refresh, seed_terms=["ไม้นวดแป้ง", "แป้งทำขนม", "กล่อง"])
+catalog_crawler.start()
+
+def fetch_product_info(search_term, max_price=None):
+    with metrics.span('fetch_product_info'):
+        results = catalog.search(search_term, max_price=max_price)
+        metrics.cache_lookup('catalog', results is not None)
+        if results is None:
+            catalog.store(search_term, product_search.search(search_term))
+            results = catalog.search(search_term, max_price=max_price)
+    # Return a maximum of 5 results, cheapest first
     return results[:5] if results else None
 
+# Terms already in the catalog are answered from the local snapshot in
+# milliseconds on the fast lane; only a live scrape takes a scrape lane slot
+# and counts against the user's rate limit
+def product_path(search_term):
+    return 'product_catalog' if catalog.has_term(search_term) else 'fetch_product_info'
 
+ensure_schema()
+load_greeting_index()
+greeting_sync.start()
+
+# Merges duplicate history nodes and rolls up old chats in the background; a
+# file lock keeps the two bots from compacting at the same time
+compaction = CompactionJob()
+compaction.start()
 
 # Flask app
 app = Flask(__name__)
 with open('usr_champ.txt', 'r') as file:
     channel_access_token, channel_secret = [line.strip() for line in file.readlines()]
 
-@app.route("/", methods=['POST'])
-def linebot():
-    body = request.get_data(as_text=True)
-    try:
-        json_data = json.loads(body)
-        line_bot_api = LineBotApi(channel_access_token)
-        handler = WebhookHandler(channel_secret)
-        handler.handle(body, request.headers['X-Line-Signature'])
-
-        msg = json_data['events'][0]['message']['text']
-        tk = json_data['events'][0]['replyToken']
-        uid = json_data['events'][0]['source']['userId']
-        global search_term 
-        global price_min
-        msg = remove_endings(msg)
-        global is_lower_selected
-        
-        if "เมนู" in msg:
-            quick_reply_options = [
-                QuickReplyButton(action=MessageAction(label="ไม้นวดแป้ง", text="ค้นหา ไม้นวดแป้ง")),
-                QuickReplyButton(action=MessageAction(label="แป้งทำขนม", text="ค้นหา แป้งทำขนม")),
-                QuickReplyButton(action=MessageAction(label="กล่อง", text="ค้นหา กล่อง")),
-            ]
-            quick_reply = QuickReply(items=quick_reply_options)
-            line_bot_api.reply_message(tk, TextSendMessage(text="ลูกค้าสนใจสินค้าแบบไหน:", quick_reply=quick_reply))
+# Shared across requests: one keep-alive LINE client and one signature checker
+line_bot_api = create_line_bot_api(channel_access_token)
+handler = WebhookHandler(channel_secret)
+
+def reply_products(reply, search_term, price_min):
+    product_info = fetch_product_info(search_term, max_price=int(price_min) if price_min else None)
+    if product_info is not None:
+        response_msg = (
+            "\n\n".join(
+                [
+                    f"• ชื่อสินค้า: {item['title']}\n  ราคา: {item['price']}\n  ลิงค์: {item['link']}\n"
+                    for item in product_info 
+                    if item['price'] != "Price not available"
+                ]
+            ) if product_info else "ไม่พบสินค้าที่ท่านต้องการ"
+        )
 
-        if "ค้นหา" in msg:
-            search_term = msg.replace("ค้นหา", "").strip()
-            reply_text = "ลูกค้ามีงบประมาณราคาไม่เกินเท่าไหร่ครับ?\nหรือจะเลือกดูทั้งหมด(show all)ก็ได้ครับ"
-            
+        if response_msg:
             quick_reply_options = [
                 QuickReplyButton(action=MessageAction(label="All", text="All")),
             ]
             quick_reply = QuickReply(items=quick_reply_options)
-            
-            line_bot_api.reply_message(tk, TextSendMessage(text=reply_text, quick_reply=quick_reply))
-
-        if "ไม่เกิน" in msg:
-            msg = msg.replace("ไม่เกิน", "").replace("ประมาณ", "").strip()
-            price_min = re.findall(r'\d+', msg)
-            price_min = ''.join(price_min)  
-            is_lower_selected = True  
-
-            product_info = fetch_product_info(search_term)
-            if product_info is not None:
-                def clean_price(price_str):
-                    price_str = price_str.replace('฿', '').replace('บาท', '').replace(',', '').strip()
-                    
-                    # ตรวจสอบ
-                    if '-' in price_str:
-                        # แยกราคา
-                        price_range = price_str.split('-')
-                        min_price = price_range[0].strip()
-                        return float(min_price)
-                    else:
-                        # ถ้าไม่มีช่วง ก็คืนราคาเดียว
-                        return float(price_str)
-
-                response_msg = (
-                    "\n\n".join(
-                        [
-                            f"• ชื่อสินค้า: {item['title']}\n  ราคา: {item['price']}\n  ลิงค์: {item['link']}\n"
-                            for item in product_info 
-                            if item['price'] != "Price not available" and clean_price(item['price']) < int(price_min)
-                        ]
-                    ) if product_info else "ไม่พบสินค้าที่ท่านต้องการ"
-                )
-
-                if response_msg:
-                    quick_reply_options = [
-                        QuickReplyButton(action=MessageAction(label="All", text="All")),
-                    ]
-                    quick_reply = QuickReply(items=quick_reply_options)
-
-                    line_bot_api.reply_message(tk, TextSendMessage(text=response_msg, quick_reply=quick_reply))
-                else:
-                    line_bot_api.reply_message(tk, TextSendMessage(text="ขออภัย ไม่มีรายการสินค้าที่ตรงกับความต้องการของคุณ"))
-            elif product_info == None:
-                line_bot_api.reply_message(tk, TextSendMessage(text="ขออภัย ไม่มีรายการสินค้าที่ตรงกับความต้องการของคุณ"))
-            
-
-        if "All" in msg:
-            product_info = fetch_product_info(search_term)
-            is_lower_selected = False 
-
-            if product_info is not None:
-                response_msg = (
-                    "\n\n".join(
-                        [
-                            f"• ชื่อสินค้า: {item['title']}\n  ราคา: {item['price']}\n  ลิงค์: {item['link']}\n"
-                            for item in product_info 
-                            if item['price'] != "Price not available"
-                        ]
-                    ) if product_info else "ไม่พบข้อมูลสินค้า"
-                )
-
-                if response_msg:
-                    line_bot_api.reply_message(tk, TextSendMessage(text=response_msg))
-                else:
-                    line_bot_api.reply_message(tk, TextSendMessage(text="ขออภัย ไม่มีรายการสินค้าที่ตรงกับความต้องการของคุณครับ"))
-            elif product_info == None:
-                line_bot_api.reply_message(tk, TextSendMessage(text="ขออภัย ไม่มีรายการสินค้าที่ตรงกับความต้องการของคุณครับ"))
-
-        # name input
-        if "ชื่อ" in msg and "อะไร" in msg:
-            user_name = get_user_name(uid)
-            if user_name:
-                line_bot_api.reply_message(tk, TextSendMessage(text=f"ชื่อของคุณคือ {user_name} ค่ะ"))
-            else:
-                line_bot_api.reply_message(tk, TextSendMessage(text="ขอโทษค่ะ ฉันไม่ทราบชื่อของคุณ"))
-
-        elif "ชื่อ" in msg and "เชื่อ" not in msg:
-            name = msg.split("ชื่อ")[-1].strip()
-            if name:
-                save_user_info(uid, name)
-                line_bot_api.reply_message(tk, TextSendMessage(text=f"ขอบคุณที่แนะนำตัวค่ะ {name}"))
-            else:
-                line_bot_api.reply_message(tk, TextSendMessage(text="ไม่สามารถระบุชื่อได้ กรุณาระบุชื่อของคุณค่ะ"))
 
-        user_name = get_user_name(uid)
-        if user_name and is_similar_query(msg, ["ชื่ออะไร", "ผมชื่ออะไร", "ชื่อของฉัน"]):
-            line_bot_api.reply_message(tk, TextSendMessage(text=f"ชื่อของคุณคือ {user_name} ค่ะ"))
-
-        response_msg = compute_response(msg)
+            reply.add(TextSendMessage(text=response_msg, quick_reply=quick_reply))
+        else:
+            reply.add(TextSendMessage(text="ขออภัย ไม่มีรายการสินค้าที่ตรงกับความต้องการของคุณ"))
+    elif product_info == None:
+        reply.add(TextSendMessage(text="ขออภัย ไม่มีรายการสินค้าที่ตรงกับความต้องการของคุณ"))
+
+def reply_all_products(reply, search_term):
+    product_info = fetch_product_info(search_term)
+
+    if product_info is not None:
+        response_msg = (
+            "\n\n".join(
+                [
+                    f"• ชื่อสินค้า: {item['title']}\n  ราคา: {item['price']}\n  ลิงค์: {item['link']}\n"
+                    for item in product_info 
+                    if item['price'] != "Price not available"
+                ]
+            ) if product_info else "ไม่พบข้อมูลสินค้า"
+        )
 
         if response_msg:
-            line_bot_api.reply_message(tk, TextSendMessage(text=response_msg + " ค่ะ"))
-            log_chat_history(uid, msg, response_msg) 
+            reply.add(TextSendMessage(text=response_msg))
+        else:
+            reply.add(TextSendMessage(text="ขออภัย ไม่มีรายการสินค้าที่ตรงกับความต้องการของคุณครับ"))
+    elif product_info == None:
+        reply.add(TextSendMessage(text="ขออภัย ไม่มีรายการสินค้าที่ตรงกับความต้องการของคุณครับ"))
+
+def respond(reply, msg, uid):
+    session = sessions.get(uid)
+    search_term = session.get('search_term')
+    with metrics.span('intents'):
+        msg = router.clean(msg)
+        intents = router.match(msg)
+    if not search_term:
+        # Price and show-all replies need a search term picked earlier
+        intents -= {'price_limit', 'show_all'}
+
+    if 'menu' in intents:
+        quick_reply_options = [
+            QuickReplyButton(action=MessageAction(label="ไม้นวดแป้ง", text="ค้นหา ไม้นวดแป้ง")),
+            QuickReplyButton(action=MessageAction(label="แป้งทำขนม", text="ค้นหา แป้งทำขนม")),
+            QuickReplyButton(action=MessageAction(label="กล่อง", text="ค้นหา กล่อง")),
+        ]
+        quick_reply = QuickReply(items=quick_reply_options)
+        reply.add(TextSendMessage(text="ลูกค้าสนใจสินค้าแบบไหน:", quick_reply=quick_reply))
+
+    if 'search' in intents:
+        search_term = msg.replace("ค้นหา", "").strip()
+        sessions.update(uid, search_term=search_term)
+        reply_text = "ลูกค้ามีงบประมาณราคาไม่เกินเท่าไหร่ครับ?\nหรือจะเลือกดูทั้งหมด(show all)ก็ได้ครับ"
+
+        quick_reply_options = [
+            QuickReplyButton(action=MessageAction(label="All", text="All")),
+        ]
+        quick_reply = QuickReply(items=quick_reply_options)
+
+        reply.add(TextSendMessage(text=reply_text, quick_reply=quick_reply))
+
+    if 'price_limit' in intents:
+        msg = msg.replace("ไม่เกิน", "").replace("ประมาณ", "").strip()
+        price_min = re.findall(r'\d+', msg)
+        price_min = ''.join(price_min)  
+        sessions.update(uid, price_min=price_min, is_lower_selected=True)
+
+        scheduler.run(reply, product_path(search_term),
+                      lambda: reply_products(reply, search_term, price_min), ack=SEARCH_ACK_TEXT)
+
+    if 'show_all' in intents:
+        sessions.update(uid, is_lower_selected=False)
+        scheduler.run(reply, product_path(search_term),
+                      lambda: reply_all_products(reply, search_term), ack=SEARCH_ACK_TEXT)
+
+    # name input
+    if 'ask_name' in intents:
+        user_name = get_user_name(uid)
+        if user_name:
+            reply.add(TextSendMessage(text=f"ชื่อของคุณคือ {user_name} ค่ะ"))
         else:
-            previous_answer = check_previous_question(msg)
-            if previous_answer:
-                line_bot_api.reply_message(tk, TextSendMessage(text=previous_answer + " ค่ะ"))
-            else:
-                print(response_msg)
-                payload = {
-                    "model": "supachai/llama-3-typhoon-v1.5",
-                    "prompt": f"ผู้ตอบเป็นผู้เชี่ยวชาญเรื่องเบเกอรี่ ผู้ถามชื่อ คุณ{user_name} ตอบสั้นๆไม่เกิน 20 คำ เกี่ยวกับ '{msg}'",
-                    "stream": False
-                }
-                response = requests.post(OLLAMA_API_URL, headers=headers, data=json.dumps(payload))
-                if response.status_code == 200:
-                    decoded_text = response.json().get("response", "")
-                    line_bot_api.reply_message(tk, TextSendMessage(text=decoded_text + 'ครับ'))
-                    save_response(uid, msg, decoded_text)  # Save the answer and response
-                else:
-                    print(f"Failed to get a response from Ollama: {response.status_code}, {response.text}")
-                    line_bot_api.reply_message(tk, TextSendMessage(text="เกิดข้อผิดพลาดในการติดต่อ LLaMA"))
+            reply.add(TextSendMessage(text="ขอโทษค่ะ ฉันไม่ทราบชื่อของคุณ"))
+
+    elif 'tell_name' in intents:
+        name = msg.split("ชื่อ")[-1].strip()
+        if name:
+            save_user_info(uid, name)
+            reply.add(TextSendMessage(text=f"ขอบคุณที่แนะนำตัวค่ะ {name}"))
+        else:
+            reply.add(TextSendMessage(text="ไม่สามารถระบุชื่อได้ กรุณาระบุชื่อของคุณค่ะ"))
+
+    if intents:
+        return
+
+    scheduler.run(reply, 'compute_response', lambda: answer(reply, msg, uid), ack=ACK_TEXT)
+
+def answer(reply, msg, uid):
+    # Single encode per message, shared by intent prototypes, greetings and the answer cache
+    ask_vec = encode([msg])[0]
+    user_name, previous_answer = get_user_context(uid, msg)
+    if user_name and router.classify(ask_vec) == 'ask_name':
+        reply.add(TextSendMessage(text=f"ชื่อของคุณคือ {user_name} ค่ะ"))
+        return
+
+    response_msg = compute_response(msg, ask_vec)
+
+    if response_msg:
+        reply.add(TextSendMessage(text=response_msg + " ค่ะ"))
+        log_chat_history(uid, msg, response_msg) 
+    else:
+        # An answer stored for this exact question wins over a cached answer
+        # to a similar one; Ollama is the last resort
+        if previous_answer:
+            reply.add(TextSendMessage(text=previous_answer + " ค่ะ"))
+            answer_cache.put(ask_vec, previous_answer)
+        elif (cached_answer := answer_cache.lookup(ask_vec)) is not None:
+            reply.add(TextSendMessage(text=cached_answer + " ค่ะ"))
+            save_response(uid, msg, cached_answer)
+        else:
+            # No per-user text in the prompt: identical questions share one
+            # generation and the answer can be cached for everyone
+            prompt = f"ผู้ตอบเป็นผู้เชี่ยวชาญเรื่องเบเกอรี่ ตอบสั้นๆไม่เกิน 20 คำ เกี่ยวกับ '{msg}'"
+            scheduler.run(reply, 'ollama', lambda: ask_ollama(reply, msg, uid, prompt, ask_vec), ack=ACK_TEXT)
+
+def ask_ollama(reply, msg, uid, prompt, ask_vec):
+    try:
+        decoded_text = ollama.generate(prompt, max_tokens=OLLAMA_ANSWER_TOKENS)
+        reply.add(TextSendMessage(text=decoded_text + 'ครับ'))
+        answer_cache.put(ask_vec, decoded_text)
+        save_response(uid, msg, decoded_text)  # Save the answer and response
+    except OllamaError as e:
+        print(f"Failed to get a response from Ollama: {e}")
+        reply.add(TextSendMessage(text="เกิดข้อผิดพลาดในการติดต่อ LLaMA"))
+
+def handle_event(event):
+    if event.get('type') != 'message' or event['message'].get('type') != 'text':
+        return
+    # Everything respond() adds goes out in one reply_message call
+    reply = Reply(line_bot_api, event)
+    scheduler.handle(reply, respond, event['message']['text'], event['source']['userId'])
+
+dispatcher = EventDispatcher(handle_event)
+
+@app.route("/", methods=['POST'])
+def linebot():
+    body = request.get_data(as_text=True)
+    try:
+        with metrics.span('webhook'):
+            handler.handle(body, request.headers['X-Line-Signature'])
+
+            # Acknowledge right away; events are handled by the worker pool
+            for event in json.loads(body)['events']:
+                dispatcher.submit(event)
 
     except InvalidSignatureError:
         return jsonify({'message': 'Invalid signature!'}), 400
 
     return jsonify({'status': 'OK'}), 200
 
+# Component stats, served as JSON on /stats and as gauges on /metrics
+component_stats = {
+    'webhook': dispatcher.stats,
+    'neo4j': query_stats,
+    'write_behind': persistence.stats,
+    'answer_cache': answer_cache.stats,
+    'ollama': ollama.stats,
+    'embedding': embedding_service.stats,
+    'reply_scheduler': scheduler.stats,
+    'compaction': compaction.stats,
+    'greeting_index': greeting_sync.stats,
+    'lane_fast': scheduler.lanes['fast'].stats,
+    'lane_llm': scheduler.lanes['llm'].stats,
+    'lane_scrape': scheduler.lanes['scrape'].stats,
+    'product_search': product_search.stats,
+    'browser_pool': browser_pool.stats,
+}
+for name, component in component_stats.items():
+    metrics.register_stats(name, component)
+
+@app.route("/stats", methods=['GET'])
+def stats():
+    return jsonify({name: component() for name, component in component_stats.items()})
+
+@app.route("/metrics", methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == "__main__":
     app.run(port=5000)
@@ -0,0 +1,238 @@
+import fcntl
+import json
+import os
+import sys
+import threading
+import time
+from graph_db import read_query, write_queries
+
+COMPACTION_INTERVAL = float(os.environ.get("COMPACTION_INTERVAL", str(24 * 3600)))
+CHAT_RETENTION_DAYS = float(os.environ.get("CHAT_RETENTION_DAYS", "30"))
+COMPACTION_BATCH = int(os.environ.get("COMPACTION_BATCH", "500"))
+COMPACTION_DIR = os.environ.get("COMPACTION_DIR", "history_archive")
+# Chat timestamps are epoch milliseconds; days are cut in this time zone
+COMPACTION_TIMEZONE = os.environ.get("COMPACTION_TIMEZONE", "Asia/Bangkok")
+
+# Relationships moved onto the surviving node when duplicates are merged:
+# (label, incoming types, outgoing types)
+DEDUPE = [
+    ('Answer', ['useranswer', 'HAS_ANSWER'], ['response']),
+    ('Response', ['response'], []),
+]
+
+DUPLICATE_GROUPS_QUERY = '''
+MATCH (n:{label}) WHERE n.text IS NOT NULL
+WITH n.text AS text, collect(elementId(n)) AS ids
+WHERE size(ids) > 1
+RETURN ids LIMIT $limit
+'''
+# Relationship counts add up, so a merged edge still says how often it happened
+MOVE_INCOMING = '''
+UNWIND $groups AS g
+MATCH (keep) WHERE elementId(keep) = g.keep
+UNWIND g.dupes AS dupe_id
+MATCH (source)-[old:{type}]->(dupe) WHERE elementId(dupe) = dupe_id
+MERGE (source)-[new:{type}]->(keep)
+  ON CREATE SET new.count = coalesce(old.count, 1)
+  ON MATCH SET new.count = coalesce(new.count, 1) + coalesce(old.count, 1)
+'''
+MOVE_OUTGOING = '''
+UNWIND $groups AS g
+MATCH (keep) WHERE elementId(keep) = g.keep
+UNWIND g.dupes AS dupe_id
+MATCH (dupe)-[old:{type}]->(target) WHERE elementId(dupe) = dupe_id
+MERGE (keep)-[new:{type}]->(target)
+  ON CREATE SET new.count = coalesce(old.count, 1)
+  ON MATCH SET new.count = coalesce(new.count, 1) + coalesce(old.count, 1)
+'''
+MERGE_DUPLICATES = '''
+UNWIND $groups AS g
+MATCH (keep) WHERE elementId(keep) = g.keep
+UNWIND g.dupes AS dupe_id
+MATCH (dupe) WHERE elementId(dupe) = dupe_id
+WITH keep, collect(dupe) AS dupes
+SET keep.count = coalesce(keep.count, 1) + reduce(total = 0, d IN dupes | total + coalesce(d.count, 1))
+FOREACH (d IN dupes | DETACH DELETE d)
+'''
+
+OLD_CHATS_QUERY = '''
+MATCH (u:User)-[:SENT]->(c:Chat) WHERE c.timestamp < $cutoff
+RETURN elementId(c) AS id, u.uid AS uid, c.message AS message, c.reply AS reply, c.timestamp AS timestamp
+ORDER BY c.timestamp LIMIT $limit
+'''
+CHATS_BY_ID_QUERY = '''
+UNWIND $ids AS id
+MATCH (u:User)-[:SENT]->(c:Chat) WHERE elementId(c) = id
+RETURN elementId(c) AS id, u.uid AS uid, c.message AS message, c.reply AS reply, c.timestamp AS timestamp
+ORDER BY c.timestamp
+'''
+# Chats are folded into one ChatDay per user and local day, then deleted.
+# Chats that are already gone (a resumed batch) are skipped, so this is
+# safe to run twice.
+ROLL_UP_CHATS = '''
+UNWIND $ids AS id
+MATCH (u:User)-[:SENT]->(c:Chat) WHERE elementId(c) = id
+WITH u, c ORDER BY c.timestamp
+WITH u, date(datetime({epochMillis: c.timestamp, timezone: $timezone})) AS day, collect(c) AS chats
+MERGE (d:ChatDay {uid: u.uid, day: day})
+MERGE (u)-[:CHATTED_ON]->(d)
+SET d.messages = coalesce(d.messages, 0) + size(chats),
+    d.first_at = CASE WHEN d.first_at IS NULL OR chats[0].timestamp < d.first_at
+                      THEN chats[0].timestamp ELSE d.first_at END,
+    d.last_at = CASE WHEN d.last_at IS NULL OR chats[-1].timestamp > d.last_at
+                     THEN chats[-1].timestamp ELSE d.last_at END
+FOREACH (c IN chats | DETACH DELETE c)
+'''
+
+
+# Background maintenance of the history nodes the bots write on every
+# message: identical Answer/Response texts are merged into one node with a
+# count, and Chat nodes past the retention window are archived to JSONL and
+# rolled up into per-user, per-day ChatDay nodes. Work is done in batches;
+# a checkpoint file records the batch in flight so an interrupted run
+# neither loses nor duplicates archived chats.
+class Compactor:
+    def __init__(self, directory=COMPACTION_DIR, retention_days=CHAT_RETENTION_DAYS,
+                 batch_size=COMPACTION_BATCH, timezone=COMPACTION_TIMEZONE):
+        self.directory = directory
+        self.retention = retention_days * 86400
+        self.batch_size = batch_size
+        self.timezone = timezone
+        self.checkpoint_path = os.path.join(directory, "checkpoint.json")
+        self.lock_path = os.path.join(directory, "compaction.lock")
+        os.makedirs(directory, exist_ok=True)
+
+    def _load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return {'pending': None, 'chats_archived': 0, 'nodes_merged': 0, 'last_run': None}
+        with open(self.checkpoint_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_checkpoint(self, checkpoint):
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def dedupe(self, label, incoming, outgoing):
+        merged = 0
+        while True:
+            records = read_query(DUPLICATE_GROUPS_QUERY.format(label=label), {'limit': self.batch_size})
+            if not records:
+                return merged
+            groups = [{'keep': record['ids'][0], 'dupes': record['ids'][1:]} for record in records]
+            statements = [MOVE_INCOMING.format(type=rel) for rel in incoming]
+            statements += [MOVE_OUTGOING.format(type=rel) for rel in outgoing]
+            statements.append(MERGE_DUPLICATES)
+            write_queries(*[(statement, {'groups': groups}) for statement in statements])
+            merged += sum(len(group['dupes']) for group in groups)
+
+    def _archive(self, path, offset, rows):
+        with open(path, 'a+b') as f:
+            # Drop whatever a crashed attempt at this batch managed to write
+            f.truncate(offset)
+            for row in rows:
+                f.write((json.dumps(row, ensure_ascii=False) + "\n").encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+
+    # The batch is marked archived before its chats are deleted. A resumed
+    # batch that is already archived must not be archived again: its chats may
+    # be gone from Neo4j, and rewriting would truncate the only copy.
+    def _finish_batch(self, checkpoint, pending):
+        if not pending.get('archived'):
+            rows = read_query(CHATS_BY_ID_QUERY, {'ids': pending['ids']})
+            rows = [{key: row[key] for key in ('uid', 'message', 'reply', 'timestamp')} for row in rows]
+            pending['end'] = self._archive(pending['path'], pending['offset'], rows)
+            pending['rows'] = len(rows)
+            pending['archived'] = True
+            self._save_checkpoint(checkpoint)
+        write_queries((ROLL_UP_CHATS, {'ids': pending['ids'], 'timezone': self.timezone}))
+        checkpoint['pending'] = None
+        checkpoint['chats_archived'] += pending['rows']
+        self._save_checkpoint(checkpoint)
+        return pending['rows']
+
+    def roll_up_chats(self, checkpoint, stopped=None):
+        archived = 0
+        if checkpoint['pending']:
+            archived += self._finish_batch(checkpoint, checkpoint['pending'])
+        cutoff = int((time.time() - self.retention) * 1000)
+        path = os.path.join(self.directory, time.strftime("chat-%Y%m%d.jsonl"))
+        while not (stopped and stopped.is_set()):
+            records = read_query(OLD_CHATS_QUERY, {'cutoff': cutoff, 'limit': self.batch_size})
+            if not records:
+                break
+            offset = os.path.getsize(path) if os.path.exists(path) else 0
+            pending = {'ids': [record['id'] for record in records], 'path': path, 'offset': offset}
+            checkpoint['pending'] = pending
+            self._save_checkpoint(checkpoint)
+            archived += self._finish_batch(checkpoint, pending)
+        return archived
+
+    # Returns None when another process holds the compaction lock
+    def run(self, stopped=None):
+        with open(self.lock_path, 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            started = time.monotonic()
+            checkpoint = self._load_checkpoint()
+            merged = 0
+            for label, incoming, outgoing in DEDUPE:
+                merged += self.dedupe(label, incoming, outgoing)
+            archived = self.roll_up_chats(checkpoint, stopped)
+            checkpoint['nodes_merged'] += merged
+            checkpoint['last_run'] = time.time()
+            self._save_checkpoint(checkpoint)
+            return {'nodes_merged': merged, 'chats_archived': archived,
+                    'seconds': time.monotonic() - started}
+
+
+class CompactionJob:
+    def __init__(self, compactor=None, interval=COMPACTION_INTERVAL, delay=300):
+        self.compactor = compactor or Compactor()
+        self.interval = interval
+        self.delay = delay
+        self.last_result = None
+        self.failures = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="compaction", daemon=True)
+
+    def start(self):
+        if self.interval > 0:
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        # Let the bot finish starting up before the first pass
+        self.stopped.wait(self.delay)
+        while not self.stopped.is_set():
+            try:
+                result = self.compactor.run(self.stopped)
+                if result is not None:
+                    self.last_result = result
+            except Exception as e:
+                self.failures += 1
+                print("Compaction failed:", e)
+            self.stopped.wait(self.interval)
+
+    def stats(self):
+        stats = dict(self.last_result or {})
+        stats['failures'] = self.failures
+        return stats
+
+
+if __name__ == "__main__":
+    result = Compactor().run()
+    if result is None:
+        print("Another compaction is running")
+        sys.exit(1)
+    print(f"Merged {result['nodes_merged']} duplicate nodes, archived {result['chats_archived']} chats "
+          f"in {result['seconds']:.1f}s")
@@ -0,0 +1,171 @@
+import os
+import threading
+import numpy as np
+
+# Seconds between re-reads of the corpus behind an index; 0 turns it off
+INDEX_SYNC_INTERVAL = float(os.environ.get("INDEX_SYNC_INTERVAL", "60"))
+
+# In-memory matrix of normalized corpus embeddings. Each row keeps its text and
+# an optional payload (e.g. the msg_reply) so a match needs no extra lookup.
+# identity() names the encoder behind encode; it is stored with the index,
+# and rows from a different encoder are dropped and encoded again.
+class EmbeddingIndex:
+    def __init__(self, encode, path=None, identity=None):
+        self.encode = encode
+        self.path = path
+        self.identity = identity
+        self.encoder = None
+        self.texts = []
+        self.payloads = []
+        self.rows = {}
+        self.matrix = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __contains__(self, text):
+        return text in self.rows
+
+    def _encode(self, texts):
+        vecs = np.asarray(self.encode(list(texts)), dtype=np.float32)
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vecs / norms
+
+    def remove(self, text):
+        with self.lock:
+            i = self.rows.pop(text, None)
+            if i is None:
+                return False
+            # Move the last row into the freed slot so removal stays O(dim).
+            last = len(self.texts) - 1
+            if i != last:
+                moved = self.texts[last]
+                self.texts[i] = moved
+                self.payloads[i] = self.payloads[last]
+                self.matrix[i] = self.matrix[last]
+                self.rows[moved] = i
+            self.texts.pop()
+            self.payloads.pop()
+            self.matrix = self.matrix[:last] if last else None
+            return True
+
+    # Bring the index in line with the given {text: payload} mapping, encoding
+    # only the texts that are new.
+    def sync(self, items):
+        items = dict(items)
+        current = self.identity() if self.identity else None
+        if current != self.encoder:
+            if self.texts:
+                print(f"Index was built with {self.encoder}, encoder is now {current}; rebuilding")
+            with self.lock:
+                self.texts, self.payloads, self.rows, self.matrix = [], [], {}, None
+            self.encoder = current
+        for text in [t for t in self.texts if t not in items]:
+            self.remove(text)
+        new = [t for t in items if t not in self.rows]
+        if new:
+            vecs = self._encode(new)
+            with self.lock:
+                for text, vec in zip(new, vecs):
+                    self.rows[text] = len(self.texts)
+                    self.texts.append(text)
+                    self.payloads.append(items[text])
+                self.matrix = vecs if self.matrix is None else np.vstack([self.matrix, vecs])
+        with self.lock:
+            for text, i in self.rows.items():
+                self.payloads[i] = items[text]
+        return len(new)
+
+    def search(self, vec, k=1):
+        with self.lock:
+            if self.matrix is None:
+                return []
+            scores = self.matrix @ np.asarray(vec, dtype=np.float32).reshape(-1)
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self.texts[i], self.payloads[i], float(scores[i])) for i in top]
+
+    def save(self, path=None):
+        path = path or self.path
+        if not path:
+            return
+        with self.lock:
+            matrix = self.matrix if self.matrix is not None else np.zeros((0, 0), dtype=np.float32)
+            tmp = path + '.tmp.npz'
+            np.savez(tmp, matrix=matrix, texts=np.array(self.texts, dtype=object),
+                     payloads=np.array(self.payloads, dtype=object), encoder=np.array(self.encoder or ""))
+        os.replace(tmp, path)
+
+    def load(self, path=None):
+        path = path or self.path
+        if not path or not os.path.exists(path):
+            return False
+        data = np.load(path, allow_pickle=True)
+        texts = list(data['texts'])
+        encoder = str(data['encoder']) if 'encoder' in data.files else None
+        current = self.identity() if self.identity else None
+        if self.identity and encoder != current:
+            print(f"{path} was built with {encoder}, encoder is now {current}; not loading it")
+            return False
+        with self.lock:
+            self.encoder = encoder or None
+            self.texts = texts
+            self.payloads = list(data['payloads'])
+            self.rows = {text: i for i, text in enumerate(texts)}
+            self.matrix = data['matrix'] if texts else None
+        return True
+
+
+# Re-reads the corpus every interval seconds and syncs the index with it, so
+# texts added or removed in Neo4j are picked up without a restart. Only new
+# texts are encoded; the index file is rewritten when anything changed.
+class IndexSync:
+    def __init__(self, index, load, interval=INDEX_SYNC_INTERVAL):
+        self.index = index
+        self.load = load
+        self.interval = interval
+        self.syncs = 0
+        self.failures = 0
+        self.added = 0
+        self.removed = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="index-sync", daemon=True)
+
+    def start(self):
+        if self.interval > 0:
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def sync(self):
+        items = self.load()
+        before = len(self.index)
+        added = self.index.sync(items)
+        removed = before + added - len(self.index)
+        if added or removed or (self.index.path and not os.path.exists(self.index.path)):
+            self.index.save()
+        self.syncs += 1
+        self.added += added
+        self.removed += removed
+        return added, removed
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.sync()
+            except Exception as e:
+                self.failures += 1
+                print("Index sync failed:", e)
+
+    def stats(self):
+        return {
+            'size': len(self.index),
+            'syncs': self.syncs,
+            'failures': self.failures,
+            'added': self.added,
+            'removed': self.removed,
+        }
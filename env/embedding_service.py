@@ -0,0 +1,239 @@
+import json
+import os
+import queue
+import stat
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+import numpy as np
+from encoder import get_encoder
+import metrics
+
+# When EMBED_SOCKET points at a running `python embedding_service.py`, every
+# worker process encodes through that one model instance; otherwise encoding
+# is batched in-process. Both sides must share a secret EMBED_AUTHKEY, and
+# the socket has to live in a directory only this user can write to.
+EMBED_SOCKET = os.environ.get("EMBED_SOCKET")
+EMBED_AUTHKEY = os.environ.get("EMBED_AUTHKEY", "").encode()
+EMBED_MAX_BATCH = int(os.environ.get("EMBED_MAX_BATCH", "32"))
+EMBED_MAX_WAIT_MS = float(os.environ.get("EMBED_MAX_WAIT_MS", "5"))
+RUNTIME_DIR = os.path.join(os.environ.get("XDG_RUNTIME_DIR") or os.path.expanduser("~/.cache"), "easytech")
+DEFAULT_SOCKET = os.path.join(RUNTIME_DIR, "embed.sock")
+MAX_REQUEST_BYTES = 1 << 20
+
+
+class EmbeddingServiceError(Exception):
+    pass
+
+
+# The socket's directory must belong to this user and be closed to everyone
+# else, so nobody can swap the socket for their own.
+def check_socket_dir(path, create=False):
+    directory = os.path.dirname(os.path.abspath(path))
+    if create:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.stat(directory)
+    if info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) & 0o077:
+        raise EmbeddingServiceError(f"{directory} must be owned by this user and not accessible to others")
+
+
+# Collects concurrent encode calls for up to max_wait seconds (or max_batch
+# sentences) and runs them through the model as one batch.
+class MicroBatcher:
+    def __init__(self, encode, max_batch=EMBED_MAX_BATCH, max_wait=EMBED_MAX_WAIT_MS / 1000):
+        self.encode_batch = encode
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.sentences = 0
+        threading.Thread(target=self._run, name="embedding-batcher", daemon=True).start()
+
+    def encode(self, sentences):
+        future = Future()
+        self.requests.put((list(sentences), future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                try:
+                    item = self.requests.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            self._encode(batch)
+
+    def _encode(self, batch):
+        # Identical sentences in the same batch are encoded once
+        unique = {}
+        for sentences, _ in batch:
+            for sentence in sentences:
+                unique.setdefault(sentence, len(unique))
+        try:
+            vecs = np.asarray(self.encode_batch(list(unique)), dtype=np.float32) if unique else None
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.sentences += len(unique)
+        for sentences, future in batch:
+            if vecs is None:
+                future.set_result(np.zeros((0, 0), dtype=np.float32))
+            else:
+                future.set_result(vecs[[unique[sentence] for sentence in sentences]])
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'sentences': self.sentences,
+            'avg_batch': self.sentences / self.batches if self.batches else 0.0,
+            'queued': self.requests.qsize(),
+        }
+
+
+# Messages are plain bytes, never pickles: a JSON request, then a JSON header
+# and, for embeddings, the raw float32 matrix. The authkey handshake runs in
+# both directions, so the client also knows it is talking to the service.
+def _send_json(conn, data):
+    conn.send_bytes(json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+def _recv_json(conn):
+    return json.loads(conn.recv_bytes(MAX_REQUEST_BYTES).decode('utf-8'))
+
+
+class RemoteEncoder:
+    def __init__(self, path, authkey=EMBED_AUTHKEY):
+        self.path = path
+        self.authkey = authkey
+        self.local = threading.local()
+
+    def _call(self, request):
+        for attempt in range(2):
+            conn = getattr(self.local, 'conn', None)
+            try:
+                if conn is None:
+                    check_socket_dir(self.path)
+                    try:
+                        conn = self.local.conn = Client(self.path, family='AF_UNIX', authkey=self.authkey)
+                    except AuthenticationError as e:
+                        raise EmbeddingServiceError(f"Embedding service rejected the authkey: {e}") from e
+                _send_json(conn, request)
+                header = _recv_json(conn)
+                body = conn.recv_bytes() if 'shape' in header else None
+            except (OSError, EOFError):
+                self.local.conn = None
+                if attempt:
+                    raise
+                continue
+            if 'error' in header:
+                raise EmbeddingServiceError(header['error'])
+            return header, body
+
+    def encode(self, sentences):
+        header, body = self._call({'op': 'encode', 'sentences': list(sentences)})
+        return np.frombuffer(body, dtype=np.float32).reshape(header['shape'])
+
+    def encoder_name(self):
+        header, _ = self._call({'op': 'info'})
+        return header['encoder']
+
+
+def serve(path=DEFAULT_SOCKET):
+    if not EMBED_AUTHKEY:
+        print("Set EMBED_AUTHKEY to a secret shared with the bots")
+        sys.exit(2)
+    check_socket_dir(path, create=True)
+    encoder = get_encoder()
+    batcher = MicroBatcher(encoder.encode)
+    if os.path.exists(path):
+        os.remove(path)
+    # The socket is created with owner-only permissions, not chmod-ed afterwards
+    umask = os.umask(0o177)
+    try:
+        listener = Listener(path, family='AF_UNIX', authkey=EMBED_AUTHKEY)
+    finally:
+        os.umask(umask)
+    print(f"Embedding service listening on {path}")
+
+    def handle(conn):
+        with conn:
+            while True:
+                try:
+                    request = _recv_json(conn)
+                except (EOFError, OSError):
+                    return
+                except ValueError as e:
+                    _send_json(conn, {'error': f"bad request: {e}"})
+                    continue
+                if isinstance(request, dict) and request.get('op') == 'info':
+                    _send_json(conn, {'encoder': encoder.name})
+                    continue
+                try:
+                    sentences = request.get('sentences') if isinstance(request, dict) else None
+                    if not isinstance(sentences, list) or not all(isinstance(x, str) for x in sentences):
+                        raise ValueError("sentences must be a list of strings")
+                    vecs = np.ascontiguousarray(batcher.encode(sentences), dtype=np.float32)
+                except Exception as e:
+                    _send_json(conn, {'error': str(e)})
+                    continue
+                _send_json(conn, {'shape': list(vecs.shape)})
+                conn.send_bytes(vecs.tobytes())
+
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:
+            print("Embedding service: rejected connection:", e)
+            continue
+        threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+
+_batcher = None
+_remote = None
+if EMBED_SOCKET and not EMBED_AUTHKEY:
+    print("EMBED_SOCKET is set without EMBED_AUTHKEY, encoding in-process")
+elif EMBED_SOCKET:
+    _remote = RemoteEncoder(EMBED_SOCKET)
+_lock = threading.Lock()
+
+def local_batcher():
+    global _batcher
+    if _batcher is None:
+        with _lock:
+            if _batcher is None:
+                _batcher = MicroBatcher(get_encoder().encode)
+    return _batcher
+
+def encode(sentences):
+    with metrics.span('encode'):
+        if _remote is not None:
+            try:
+                return _remote.encode(sentences)
+            except (OSError, EOFError, EmbeddingServiceError) as e:
+                print("Embedding service unavailable, encoding in-process:", e)
+        return local_batcher().encode(sentences)
+
+# Identity of the encoder that encode() currently goes through
+def encoder_name():
+    if _remote is not None:
+        try:
+            return _remote.encoder_name()
+        except (OSError, EOFError, EmbeddingServiceError) as e:
+            print("Embedding service unavailable, encoding in-process:", e)
+    return get_encoder().name
+
+def stats():
+    return local_batcher().stats() if _batcher is not None else {}
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1] if len(sys.argv) > 1 else EMBED_SOCKET or DEFAULT_SOCKET)
@@ -0,0 +1,162 @@
+import os
+import sys
+import threading
+import numpy as np
+
+MODEL_NAME = 'sentence-transformers/distiluse-base-multilingual-cased-v2'
+# "torch" runs the SentenceTransformer model as before; "onnx" runs the int8
+# quantized export made by `python encoder.py export` on onnxruntime.
+ENCODER_BACKEND = os.environ.get("ENCODER_BACKEND", "torch")
+ONNX_DIR = os.environ.get("ENCODER_ONNX_DIR", "distiluse_onnx_int8")
+ONNX_MODEL = "model_int8.onnx"
+MAX_SEQ_LENGTH = 128
+
+
+def _normalize(vecs):
+    vecs = np.asarray(vecs, dtype=np.float32)
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vecs / norms
+
+
+# name identifies the vectors an encoder produces; indexes built with one
+# encoder are rebuilt rather than mixed with another's rows
+class TorchEncoder:
+    def __init__(self, model_name=MODEL_NAME):
+        self.model_name = model_name
+        self.name = f"torch/{model_name}"
+        self.model = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.model is None:
+            with self.lock:
+                if self.model is None:
+                    from sentence_transformers import SentenceTransformer
+                    self.model = SentenceTransformer(self.model_name, device='cpu')
+        return self.model
+
+    def encode(self, sentences):
+        return _normalize(self.load().encode(list(sentences), convert_to_numpy=True))
+
+
+# Pooling and the 768->512 dense layer are part of the exported graph, so the
+# session output is already the sentence embedding.
+class OnnxEncoder:
+    def __init__(self, model_dir=ONNX_DIR, threads=None):
+        self.model_dir = model_dir
+        self.name = f"onnx-int8/{MODEL_NAME}"
+        self.threads = threads
+        self.session = None
+        self.tokenizer = None
+        self.lock = threading.Lock()
+
+    def available(self):
+        return os.path.exists(os.path.join(self.model_dir, ONNX_MODEL))
+
+    def load(self):
+        if self.session is None:
+            with self.lock:
+                if self.session is None:
+                    import onnxruntime
+                    from tokenizers import Tokenizer
+                    tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, "tokenizer.json"))
+                    tokenizer.enable_truncation(MAX_SEQ_LENGTH)
+                    tokenizer.enable_padding()
+                    options = onnxruntime.SessionOptions()
+                    if self.threads:
+                        options.intra_op_num_threads = self.threads
+                    self.tokenizer = tokenizer
+                    self.session = onnxruntime.InferenceSession(
+                        os.path.join(self.model_dir, ONNX_MODEL), options, providers=['CPUExecutionProvider'])
+        return self.session
+
+    def encode(self, sentences):
+        session = self.load()
+        batch = self.tokenizer.encode_batch(list(sentences))
+        inputs = {
+            'input_ids': np.array([item.ids for item in batch], dtype=np.int64),
+            'attention_mask': np.array([item.attention_mask for item in batch], dtype=np.int64),
+        }
+        return _normalize(session.run(['sentence_embedding'], inputs)[0])
+
+
+def export_onnx(model_dir=ONNX_DIR, model_name=MODEL_NAME):
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    st = SentenceTransformer(model_name, device='cpu')
+    transformer, dense = st[0].auto_model, st[2]
+
+    class SentenceEmbedding(torch.nn.Module):
+        def forward(self, input_ids, attention_mask):
+            tokens = transformer(input_ids=input_ids, attention_mask=attention_mask)[0]
+            mask = attention_mask.unsqueeze(-1).to(tokens.dtype)
+            pooled = (tokens * mask).sum(1) / mask.sum(1).clamp(min=1e-9)
+            return dense({'sentence_embedding': pooled})['sentence_embedding']
+
+    os.makedirs(model_dir, exist_ok=True)
+    fp32_path = os.path.join(model_dir, "model.onnx")
+    sample = st.tokenizer(["สวัสดีครับ"], return_tensors='pt')
+    torch.onnx.export(
+        SentenceEmbedding().eval(), (sample['input_ids'], sample['attention_mask']), fp32_path,
+        input_names=['input_ids', 'attention_mask'], output_names=['sentence_embedding'],
+        dynamic_axes={'input_ids': {0: 'batch', 1: 'sequence'},
+                      'attention_mask': {0: 'batch', 1: 'sequence'},
+                      'sentence_embedding': {0: 'batch'}},
+        opset_version=14,
+    )
+    quantize_dynamic(fp32_path, os.path.join(model_dir, ONNX_MODEL), weight_type=QuantType.QInt8)
+    st.tokenizer.save_pretrained(model_dir)
+    os.remove(fp32_path)
+
+
+CHECK_SENTENCES = [
+    "สวัสดีครับ", "สวัสดีค่ะ", "ชื่ออะไร", "ผมชื่ออะไร", "ชื่อของฉัน",
+    "แป้งเค้กใช้ยังไง", "ค้นหา แป้งทำขนม", "ไม้นวดแป้งราคาเท่าไหร่", "ขอบคุณครับ", "hello",
+]
+
+# Compares the int8 ONNX encoder with the fp32 model: each sentence's two
+# embeddings must agree, and so must the pairwise cosine scores that the
+# greeting match and the answer cache thresholds are applied to.
+def check_equivalence(sentences=CHECK_SENTENCES, model_dir=ONNX_DIR, min_self=0.98, max_score_diff=0.03):
+    reference = TorchEncoder().encode(sentences)
+    quantized = OnnxEncoder(model_dir).encode(sentences)
+    self_scores = (reference * quantized).sum(axis=1)
+    score_diff = np.abs(reference @ reference.T - quantized @ quantized.T).max()
+    print(f"min cosine(fp32, int8) = {self_scores.min():.4f}, max pairwise score difference = {score_diff:.4f}")
+    return bool(self_scores.min() >= min_self and score_diff <= max_score_diff)
+
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+def get_encoder():
+    global _encoder
+    if _encoder is None:
+        with _encoder_lock:
+            if _encoder is None:
+                onnx = OnnxEncoder()
+                if ENCODER_BACKEND == "onnx" and onnx.available():
+                    _encoder = onnx
+                else:
+                    if ENCODER_BACKEND == "onnx":
+                        print(f"No ONNX model in {ONNX_DIR}, using the PyTorch encoder")
+                    _encoder = TorchEncoder()
+    return _encoder
+
+# Normalized float32 embeddings, one row per sentence; the model is loaded on first use
+def encode(sentences):
+    return get_encoder().encode(sentences)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "export":
+        export_onnx()
+    elif command == "check":
+        sys.exit(0 if check_equivalence() else 1)
+    else:
+        print("usage: python encoder.py export|check")
+        sys.exit(2)
@@ -0,0 +1,114 @@
+from neo4j import GraphDatabase
+from neo4j.exceptions import ServiceUnavailable, SessionExpired, TransientError
+import atexit
+import os
+import threading
+import time
+import metrics
+
+# Connection settings, overridable from the environment
+URI = os.environ.get("NEO4J_URI", "bolt://localhost:7687")
+AUTH = (os.environ.get("NEO4J_USER", "neo4j"), os.environ.get("NEO4J_PASSWORD", "test"))
+DATABASE = os.environ.get("NEO4J_DATABASE") or None
+POOL_SIZE = int(os.environ.get("NEO4J_POOL_SIZE", "50"))
+ACQUIRE_TIMEOUT = float(os.environ.get("NEO4J_ACQUIRE_TIMEOUT", "30"))
+CONNECTION_LIFETIME = float(os.environ.get("NEO4J_CONNECTION_LIFETIME", "3600"))
+
+_driver = None
+_driver_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {
+    'reads': 0,
+    'writes': 0,
+    'queries': 0,
+    'pool_wait_total': 0.0,
+    'pool_wait_max': 0.0,
+    'query_time_total': 0.0,
+    'query_time_max': 0.0,
+}
+
+
+# One driver per process; it owns the connection pool shared by every call.
+def get_driver():
+    global _driver
+    if _driver is None:
+        with _driver_lock:
+            if _driver is None:
+                driver = GraphDatabase.driver(
+                    URI, auth=AUTH,
+                    max_connection_pool_size=POOL_SIZE,
+                    connection_acquisition_timeout=ACQUIRE_TIMEOUT,
+                    max_connection_lifetime=CONNECTION_LIFETIME,
+                )
+                driver.verify_connectivity()
+                _driver = driver
+    return _driver
+
+def close():
+    global _driver
+    with _driver_lock:
+        if _driver is not None:
+            _driver.close()
+            _driver = None
+
+atexit.register(close)
+
+def _record(kind, count, wait, elapsed):
+    with _stats_lock:
+        _stats[kind] += 1
+        _stats['queries'] += count
+        _stats['pool_wait_total'] += wait
+        _stats['pool_wait_max'] = max(_stats['pool_wait_max'], wait)
+        _stats['query_time_total'] += elapsed
+        _stats['query_time_max'] = max(_stats['query_time_max'], elapsed)
+
+def _execute(kind, queries):
+    start = time.perf_counter()
+    timing = {}
+
+    def work(tx):
+        began = time.perf_counter()
+        timing['wait'] = began - start
+        # Issue every statement before reading any result so the driver can
+        # pipeline them over the same connection.
+        results = [tx.run(query, parameters or {}) for query, parameters in queries]
+        records = [list(result) for result in results]
+        timing['elapsed'] = time.perf_counter() - began
+        return records
+
+    metrics.round_trip()
+    with metrics.span('neo4j_read' if kind == 'reads' else 'neo4j_write'):
+        with get_driver().session(database=DATABASE) as session:
+            if kind == 'reads':
+                records = session.execute_read(work)
+            else:
+                records = session.execute_write(work)
+    _record(kind, len(queries), timing.get('wait', 0.0), timing.get('elapsed', 0.0))
+    return records
+
+def read_query(query, parameters=None):
+    return _execute('reads', [(query, parameters)])[0]
+
+def write_query(query, parameters=None):
+    return _execute('writes', [(query, parameters)])[0]
+
+# Run several reads in one managed transaction: read_queries((q1, p1), (q2, p2))
+def read_queries(*queries):
+    return _execute('reads', list(queries))
+
+def write_queries(*queries):
+    return _execute('writes', list(queries))
+
+# True for failures where the same write may succeed later, as opposed to
+# Neo4j rejecting the statement or its data
+def is_unavailable(error):
+    return isinstance(error, (ServiceUnavailable, SessionExpired, TransientError))
+
+def query_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    transactions = stats['reads'] + stats['writes']
+    stats['pool_wait_avg'] = stats['pool_wait_total'] / transactions if transactions else 0.0
+    stats['query_time_avg'] = stats['query_time_total'] / transactions if transactions else 0.0
+    stats['pool_size'] = POOL_SIZE
+    return stats
@@ -0,0 +1,69 @@
+import re
+import numpy as np
+
+ENDINGS = ["ครับ", "ค่ะ", "น้ะ", "นะ", "นะจ้ะ"]
+
+
+def _alternation(words):
+    # Longest first, so "นะจ้ะ" wins over "นะ" at the same position
+    return re.compile("|".join(re.escape(word) for word in sorted(set(words), key=len, reverse=True)))
+
+
+class Intent:
+    def __init__(self, name, any_of=(), all_of=(), none_of=(), exact=(), prototypes=(), threshold=0.7):
+        self.name = name
+        self.any_of = set(any_of)
+        self.all_of = set(all_of)
+        self.none_of = set(none_of)
+        self.exact = set(exact)
+        self.prototypes = list(prototypes)
+        self.threshold = threshold
+
+    def matches(self, text, found):
+        if self.exact and text in self.exact:
+            return True
+        if not (self.any_of or self.all_of):
+            return False
+        return (not self.any_of or bool(self.any_of & found)) \
+            and self.all_of <= found and not (self.none_of & found)
+
+
+# Intent table compiled once: every keyword of every intent goes into one
+# regex that is scanned in a single pass, and intent prototype phrases are
+# encoded once (on first use) so semantic matching reuses the message
+# embedding.
+class IntentRouter:
+    def __init__(self, intents, encode=None, endings=ENDINGS):
+        self.intents = list(intents)
+        self.endings = _alternation(endings)
+        keywords = set()
+        for intent in self.intents:
+            keywords |= intent.any_of | intent.all_of | intent.none_of
+        self.keywords = _alternation(keywords) if keywords else None
+        self.encode = encode
+        self.phrases = []
+        self.prototype_intents = []
+        self.prototypes = None
+        for intent in self.intents:
+            for phrase in intent.prototypes:
+                self.phrases.append(phrase)
+                self.prototype_intents.append(intent)
+
+    def clean(self, text):
+        return self.endings.sub("", text).strip()
+
+    def match(self, text):
+        # Matches do not overlap, so a longer keyword such as "เชื่อ" hides
+        # the "ชื่อ" inside it.
+        found = set(self.keywords.findall(text)) if self.keywords else set()
+        return {intent.name for intent in self.intents if intent.matches(text, found)}
+
+    def classify(self, vec):
+        if not self.phrases or self.encode is None:
+            return None
+        if self.prototypes is None:
+            self.prototypes = np.asarray(self.encode(self.phrases), dtype=np.float32)
+        scores = self.prototypes @ np.asarray(vec, dtype=np.float32).reshape(-1)
+        best = int(np.argmax(scores))
+        intent = self.prototype_intents[best]
+        return intent.name if scores[best] > intent.threshold else None
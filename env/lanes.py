@@ -0,0 +1,128 @@
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+import metrics
+
+# Worker threads per lane. Cheap embedding/greeting work never waits behind
+# LLM generations or page scrapes, which have lanes of their own sized to
+# what Ollama and the browser pool can actually run at once.
+LANE_WORKERS = {
+    'fast': int(os.environ.get("LANE_FAST_WORKERS", "8")),
+    'llm': int(os.environ.get("LANE_LLM_WORKERS", os.environ.get("OLLAMA_PARALLEL", "2"))),
+    'scrape': int(os.environ.get("LANE_SCRAPE_WORKERS", os.environ.get("BROWSER_POOL_SIZE", "2"))),
+}
+LANE_QUEUE_SIZE = int(os.environ.get("LANE_QUEUE_SIZE", "200"))
+# Tokens a job on each lane costs from the user's bucket
+LANE_COSTS = {'fast': 0, 'llm': 1, 'scrape': 1}
+USER_RATE = float(os.environ.get("USER_RATE", "0.2"))
+USER_BURST = float(os.environ.get("USER_BURST", "3"))
+
+
+class Lane:
+    def __init__(self, name, workers, max_queue=LANE_QUEUE_SIZE):
+        self.name = name
+        self.workers = workers
+        self.jobs = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_last = 0.0
+        self.wait_max = 0.0
+        self.wait_total = 0.0
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"lane-{name}-{i}", daemon=True).start()
+
+    # Returns False when the lane's queue is full
+    def submit(self, fn):
+        try:
+            self.jobs.put_nowait((time.monotonic(), fn))
+            return True
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            return False
+
+    def _work(self):
+        while True:
+            enqueued, fn = self.jobs.get()
+            wait = time.monotonic() - enqueued
+            metrics.LANE_WAIT.observe(wait, lane=self.name)
+            with self.lock:
+                self.running += 1
+                self.wait_last = wait
+                self.wait_max = max(self.wait_max, wait)
+                self.wait_total += wait
+            try:
+                fn()
+            except Exception as e:
+                print(f"Error in {self.name} lane:", e)
+            finally:
+                with self.lock:
+                    self.running -= 1
+                    self.completed += 1
+
+    def stats(self):
+        with self.lock:
+            started = self.completed + self.running
+            return {
+                'workers': self.workers,
+                'queue_depth': self.jobs.qsize(),
+                'running': self.running,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'wait_last': self.wait_last,
+                'wait_max': self.wait_max,
+                'wait_avg': self.wait_total / started if started else 0.0,
+            }
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, cost=1):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+
+# One token bucket per user for expensive work; buckets of users not seen
+# for a while are dropped once max_users is reached.
+class RateLimiter:
+    def __init__(self, rate=USER_RATE, burst=USER_BURST, max_users=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+        self.limited = 0
+
+    def allow(self, uid, cost=1):
+        if not cost or not uid:
+            return True
+        with self.lock:
+            bucket = self.buckets.get(uid)
+            if bucket is None:
+                bucket = self.buckets[uid] = TokenBucket(self.rate, self.burst)
+                while len(self.buckets) > self.max_users:
+                    self.buckets.popitem(last=False)
+            self.buckets.move_to_end(uid)
+            if bucket.take(cost):
+                return True
+            self.limited += 1
+            return False
+
+
+# names limits the lanes to the ones a bot actually uses
+def create_lanes(names=None, workers=LANE_WORKERS):
+    return {name: Lane(name, count) for name, count in workers.items() if names is None or name in names}
@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from linebot import LineBotApi
+from linebot.exceptions import LineBotApiError
+from linebot.http_client import RequestsHttpClient, RequestsHttpResponse
+import metrics
+
+# Pointed at a local stand-in by the benchmark harness
+LINE_API_ENDPOINT = os.environ.get("LINE_API_ENDPOINT", LineBotApi.DEFAULT_API_ENDPOINT)
+MAX_MESSAGES = 5
+# LINE only accepts a reply token for a short while after the event; past this
+# age the messages are pushed instead.
+REPLY_TOKEN_TTL = 50
+
+
+# RequestsHttpClient opens a new connection per call; this keeps them alive
+class PooledHttpClient(RequestsHttpClient):
+    def __init__(self, timeout=RequestsHttpClient.DEFAULT_TIMEOUT, pool_size=20):
+        super().__init__(timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        response = self.session.get(url, headers=headers, params=params, stream=stream,
+                                    timeout=timeout or self.timeout)
+        return RequestsHttpResponse(response)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        response = self.session.post(url, headers=headers, data=data, timeout=timeout or self.timeout)
+        return RequestsHttpResponse(response)
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        response = self.session.put(url, headers=headers, data=data, timeout=timeout or self.timeout)
+        return RequestsHttpResponse(response)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        response = self.session.delete(url, headers=headers, data=data, timeout=timeout or self.timeout)
+        return RequestsHttpResponse(response)
+
+
+def create_line_bot_api(channel_access_token):
+    return LineBotApi(channel_access_token, endpoint=LINE_API_ENDPOINT, http_client=PooledHttpClient)
+
+
+# Collects the messages produced while handling one event and sends them in a
+# single reply_message call. Later sends, an expired token or more than five
+# messages fall back to push_message.
+#
+# Work for the reply may continue in other threads: each piece holds the
+# reply and releases it when done, and the messages go out when the last
+# holder (the event handler itself counts as one) lets go.
+class Reply:
+    def __init__(self, line_bot_api, event):
+        self.line_bot_api = line_bot_api
+        self.reply_token = event.get('replyToken')
+        self.user_id = event.get('source', {}).get('userId')
+        timestamp = event.get('timestamp')
+        self.received = timestamp / 1000 if timestamp else time.time()
+        self.messages = []
+        self.token_used = False
+        self.lock = threading.RLock()
+        self.holders = 1
+        self.done = False
+        self.callbacks = []
+
+    def add(self, *messages):
+        with self.lock:
+            self.messages.extend(messages)
+
+    def hold(self):
+        with self.lock:
+            self.holders += 1
+
+    def release(self):
+        with self.lock:
+            self.holders -= 1
+            if self.holders:
+                return
+            self.done = True
+            callbacks, self.callbacks = self.callbacks, []
+            try:
+                self._send()
+            finally:
+                for callback in callbacks:
+                    callback()
+
+    # fn() runs once every holder has released the reply, or right away if
+    # that has already happened
+    def when_done(self, fn):
+        with self.lock:
+            if not self.done:
+                self.callbacks.append(fn)
+                return
+        fn()
+
+    def token_fresh(self):
+        return bool(self.reply_token) and not self.token_used \
+            and time.time() - self.received < REPLY_TOKEN_TTL
+
+    def send(self):
+        with self.lock:
+            self._send()
+
+    def _send(self):
+        messages, self.messages = self.messages, []
+        if not messages:
+            return
+        if self.token_fresh():
+            batch, messages = messages[:MAX_MESSAGES], messages[MAX_MESSAGES:]
+            self.token_used = True
+            try:
+                with metrics.span('line_reply'):
+                    self.line_bot_api.reply_message(self.reply_token, batch)
+            except LineBotApiError as e:
+                # Invalid or expired reply token: deliver the same messages by push
+                if e.status_code != 400 or not self.user_id:
+                    raise
+                messages = batch + messages
+        for i in range(0, len(messages), MAX_MESSAGES):
+            with metrics.span('line_push'):
+                self.line_bot_api.push_message(self.user_id, messages[i:i + MAX_MESSAGES])
@@ -0,0 +1,181 @@
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+# Set METRICS_ENABLED=0 to turn every span and counter into a no-op
+ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+PREFIX = "easytech_"
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not ENABLED:
+            return
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=SECONDS_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not ENABLED:
+            return
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                le_names = self.label_names + ("le",)
+                for bound, bucket in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_labels(le_names, key + (str(float(bound)),))} {bucket}")
+                lines.append(f"{self.name}_bucket{_labels(le_names, key + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("stage_seconds", "Time spent in each stage of handling a message", labels=("stage",))
+EVENTS = Counter("events_total", "Webhook events handled", labels=("result",))
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Cache lookups by cache and result", labels=("cache", "result"))
+NEO4J_ROUND_TRIPS = Histogram("neo4j_round_trips_per_event", "Neo4j transactions issued while handling one event",
+                              buckets=(0, 1, 2, 3, 4, 6, 8, 12))
+OLLAMA_TOKENS = Counter("ollama_tokens_total", "Tokens received from Ollama")
+OLLAMA_TOKEN_RATE = Histogram("ollama_tokens_per_second", "Ollama generation speed per request",
+                              buckets=(1, 2, 5, 10, 20, 30, 50, 100))
+LANE_WAIT = Histogram("lane_wait_seconds", "Time jobs wait in a lane queue before a worker picks them up",
+                      labels=("lane",))
+METRICS = [STAGE_SECONDS, EVENTS, CACHE_LOOKUPS, NEO4J_ROUND_TRIPS, OLLAMA_TOKENS, OLLAMA_TOKEN_RATE, LANE_WAIT]
+
+_NULL_SPAN = nullcontext()
+# Neo4j round trips of the event being handled; the reply scheduler copies the
+# context into its lanes so work done there is counted too.
+_round_trips = ContextVar("round_trips", default=None)
+
+
+@contextmanager
+def _span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+def span(stage):
+    return _span(stage) if ENABLED else _NULL_SPAN
+
+
+# One webhook event. Entering the scope makes Neo4j calls count towards it;
+# finish() is called once the event's reply is complete, which may be after
+# work in other lanes has finished.
+class EventScope:
+    def __init__(self):
+        self.trips = [0]
+        self.start = time.perf_counter()
+        self.failed = False
+        self.token = None
+
+    def __enter__(self):
+        self.token = _round_trips.set(self.trips)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _round_trips.reset(self.token)
+        if exc_type is not None:
+            self.failed = True
+
+    def finish(self):
+        EVENTS.inc(result="failed" if self.failed else "handled")
+        STAGE_SECONDS.observe(time.perf_counter() - self.start, stage="handle_event")
+        NEO4J_ROUND_TRIPS.observe(self.trips[0])
+
+
+class _NullScope:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def finish(self):
+        pass
+
+_NULL_SCOPE = _NullScope()
+
+def event():
+    return EventScope() if ENABLED else _NULL_SCOPE
+
+def round_trip():
+    trips = _round_trips.get()
+    if trips is not None:
+        trips[0] += 1
+
+def cache_lookup(cache, hit):
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+# Numeric values from the components' stats() dicts are exported as gauges
+_collectors = []
+
+def register_stats(name, stats):
+    _collectors.append((name, stats))
+
+def render():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for name, stats in _collectors:
+        try:
+            values = stats()
+        except Exception as e:
+            print(f"Metrics: {name} stats failed: {e}")
+            continue
+        for key, value in sorted(values.items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            metric = f"{PREFIX}{name}_{key}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
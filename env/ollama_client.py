@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from singleflight import SingleFlight
+import metrics
+
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434")
+OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "supachai/llama-3-typhoon-v1.5")
+# Should match OLLAMA_NUM_PARALLEL on the server; extra requests wait here
+# instead of piling up inside Ollama.
+OLLAMA_PARALLEL = int(os.environ.get("OLLAMA_PARALLEL", "2"))
+OLLAMA_TIMEOUT = float(os.environ.get("OLLAMA_TIMEOUT", "30"))
+# Token cap for the short answers the bots ask for. The prompt asks for at
+# most 20 words; this only stops a model that ignores it.
+OLLAMA_ANSWER_TOKENS = int(os.environ.get("OLLAMA_ANSWER_TOKENS", "120"))
+
+
+class OllamaError(Exception):
+    pass
+
+
+class OllamaClient:
+    def __init__(self, base_url=OLLAMA_URL, model=OLLAMA_MODEL, parallel=OLLAMA_PARALLEL,
+                 timeout=OLLAMA_TIMEOUT, connect_timeout=2.0):
+        self.generate_url = base_url.rstrip('/') + "/api/generate"
+        self.model = model
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=parallel * 2)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.slots = threading.BoundedSemaphore(parallel)
+        self.flights = SingleFlight()
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.running = 0
+        self.generations = 0
+        self.timeouts = 0
+        self.tokens = 0
+        self.generate_seconds = 0.0
+
+    # Identical prompts that are already being generated share that generation,
+    # so callers should keep per-user details out of prompts for shared answers.
+    # max_tokens caps the generation on the server (num_predict); counting
+    # words on our side does not work for Thai, which has no spaces.
+    def generate(self, prompt, max_tokens=None, stream=True, timeout=None, options=None):
+        if max_tokens:
+            options = dict(options or {}, num_predict=max_tokens)
+        key = (self.model, prompt, stream, json.dumps(options, sort_keys=True))
+        with metrics.span('ollama'):
+            return self.flights.do(key, self._generate, prompt, stream, timeout or self.timeout, options)
+
+    def _generate(self, prompt, stream, timeout, options):
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            self.waiting += 1
+        acquired = self.slots.acquire(timeout=timeout)
+        with self.lock:
+            self.waiting -= 1
+        if not acquired:
+            self._count_timeout()
+            raise OllamaError("Timed out waiting for a free Ollama slot")
+        with self.lock:
+            self.running += 1
+        started = time.monotonic()
+        try:
+            payload = {"model": self.model, "prompt": prompt, "stream": stream}
+            if options:
+                payload["options"] = options
+            read_timeout = max(deadline - time.monotonic(), 0.1)
+            with self.session.post(self.generate_url, json=payload, stream=stream,
+                                   timeout=(self.connect_timeout, read_timeout)) as response:
+                if response.status_code != 200:
+                    raise OllamaError(f"{response.status_code}, {response.text}")
+                if not stream:
+                    data = self._parse(response.content)
+                    self._count_tokens(data.get("eval_count", 0), started)
+                    return data.get("response", "")
+                return self._read_stream(response, deadline, started)
+        except requests.Timeout as e:
+            self._count_timeout()
+            raise OllamaError(f"Ollama request timed out: {e}") from e
+        except requests.RequestException as e:
+            raise OllamaError(str(e)) from e
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.generations += 1
+                self.generate_seconds += time.monotonic() - started
+            self.slots.release()
+
+    # Ollama reports failures as {"error": ...}, also in the middle of a stream
+    def _parse(self, line):
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            raise OllamaError(f"Unreadable response from Ollama: {e}") from e
+        if not isinstance(data, dict):
+            raise OllamaError(f"Unexpected response from Ollama: {data!r}")
+        if data.get("error"):
+            raise OllamaError(data["error"])
+        return data
+
+    def _read_stream(self, response, deadline, started):
+        parts = []
+        chunks = 0
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = self._parse(line)
+            parts.append(chunk.get("response", ""))
+            chunks += 1
+            if chunk.get("done"):
+                break
+            if time.monotonic() > deadline:
+                # Leaving the with-block closes the connection, which makes
+                # Ollama stop generating for this request.
+                if not "".join(parts).strip():
+                    self._count_timeout()
+                    raise OllamaError("Ollama generation exceeded its deadline")
+                break
+        self._count_tokens(chunks, started)
+        return "".join(parts).strip()
+
+    def _count_tokens(self, count, started):
+        with self.lock:
+            self.tokens += count
+        elapsed = time.monotonic() - started
+        metrics.OLLAMA_TOKENS.inc(count)
+        if count and elapsed > 0:
+            metrics.OLLAMA_TOKEN_RATE.observe(count / elapsed)
+
+    def _count_timeout(self):
+        with self.lock:
+            self.timeouts += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'waiting': self.waiting,
+                'running': self.running,
+                'generations': self.generations,
+                'coalesced': self.flights.shared,
+                'timeouts': self.timeouts,
+                'tokens': self.tokens,
+                'tokens_per_second': self.tokens / self.generate_seconds if self.generate_seconds else 0.0,
+            }
@@ -0,0 +1,99 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote_plus
+from bs4 import BeautifulSoup, SoupStrainer
+from singleflight import SingleFlight
+import metrics
+
+SEARCH_URL = "https://www.bakeryclick.com/search?q={}"
+PRODUCT_URL = "https://www.bakeryclick.com{}"
+
+try:
+    import lxml  # noqa: F401
+    PARSER = "lxml"
+except ImportError:
+    PARSER = "html.parser"
+
+# Only the product name blocks are turned into a tree; the rest of the page
+# is skipped by the tokenizer.
+PRODUCT_CARDS = SoupStrainer("div", class_="product_name")
+
+
+def parse_products(html):
+    results = []
+    for card in BeautifulSoup(html, PARSER, parse_only=PRODUCT_CARDS).find_all("div", class_="product_name"):
+        title_text = card.get_text(strip=True)
+        link_element = card.find("a")
+        link = PRODUCT_URL.format(link_element['href']) if link_element else "Link not available"
+
+        # Additional product data is kept as JSON in the gaeepd attribute
+        gaeepd_data = link_element.get('gaeepd') if link_element else None
+        product_info = json.loads(gaeepd_data.replace('&quot;', '"')) if gaeepd_data else {}
+
+        price_text = product_info.get("price", "Price not available")
+        price_text = f"{price_text} บาท" if price_text != "Price not available" else price_text
+
+        results.append({
+            'title': title_text,
+            'price': price_text,
+            'link': link
+        })
+    return results
+
+
+def normalize_term(search_term):
+    return " ".join(search_term.split()).lower()
+
+
+# Per-search-term result cache in front of the browser pool. Concurrent
+# searches for the same term share a single page load.
+class ProductSearch:
+    def __init__(self, pool, ttl=600, empty_ttl=60, max_size=256):
+        self.pool = pool
+        self.ttl = ttl
+        self.empty_ttl = empty_ttl
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.flights = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    def search(self, search_term):
+        key = normalize_term(search_term)
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.cache.move_to_end(key)
+                self.hits += 1
+                metrics.cache_lookup('product_search', True)
+                return entry[1]
+            self.misses += 1
+            metrics.cache_lookup('product_search', False)
+        return self.flights.do(key, self._load, key)
+
+    # Load the page again regardless of what is cached (used by the crawler)
+    def refresh(self, search_term):
+        key = normalize_term(search_term)
+        return self.flights.do(key, self._load, key)
+
+    def _load(self, key):
+        with metrics.span('browser_load'), self.pool.driver() as driver:
+            driver.get(SEARCH_URL.format(quote_plus(key)))
+            html = driver.page_source
+        with metrics.span('parse_products'):
+            results = parse_products(html)
+        expires = time.monotonic() + (self.ttl if results else self.empty_ttl)
+        with self.lock:
+            self.cache[key] = (expires, results)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+        return results
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.cache),
+                    'coalesced': self.flights.shared}
@@ -0,0 +1,171 @@
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from linebot.models import TextSendMessage
+import metrics
+from lanes import LANE_COSTS, RateLimiter, create_lanes
+
+# Seconds a path may take before the user gets an acknowledgement and the
+# answer is pushed when it is ready. Override with e.g. REPLY_BUDGET_OLLAMA=3.
+DEFAULT_BUDGETS = {
+    'compute_response': 1.0,
+    'product_catalog': 1.0,
+    'fetch_product_info': 2.0,
+    'ollama': 2.5,
+}
+BUDGETS = {path: float(os.environ.get(f"REPLY_BUDGET_{path.upper()}", budget))
+           for path, budget in DEFAULT_BUDGETS.items()}
+# Lane each path runs on, by expected cost
+PATH_LANES = {
+    'compute_response': 'fast',
+    'product_catalog': 'fast',
+    'fetch_product_info': 'scrape',
+    'ollama': 'llm',
+}
+RATE_LIMITED_TEXT = "มีคำขอจากคุณเข้ามาถี่เกินไป กรุณารอสักครู่แล้วลองใหม่อีกครั้ง"
+BUSY_TEXT = "ขณะนี้มีผู้ใช้งานจำนวนมาก กรุณาลองใหม่อีกครั้งในภายหลัง"
+
+
+# Runs the slow reply paths on priority lanes (fast, llm, scrape) so webhook
+# workers never wait on them. If a path misses its budget, whatever the Reply
+# holds goes out on the reply token with a short acknowledgement, and the
+# answer is pushed once the work finishes. Expensive lanes are rate limited
+# per user.
+#
+# A user's events are still handled one at a time: an event that arrives
+# while the user's previous reply is open starts once that reply has gone
+# out, on the fast lane, without holding up the webhook worker.
+class ReplyScheduler:
+    def __init__(self, budgets=BUDGETS, lanes=None, limiter=None):
+        self.budgets = dict(budgets)
+        self.lanes = lanes or create_lanes()
+        self.limiter = limiter or RateLimiter()
+        self.lock = threading.Lock()
+        self.open_replies = {}
+        self.on_time = 0
+        self.deferred = 0
+        self.failed = 0
+        self.busy = 0
+        self.queued_behind = 0
+        self.timers = []
+        self.timer_seq = itertools.count()
+        self.timer_cond = threading.Condition()
+        threading.Thread(target=self._run_timers, name="reply-deadlines", daemon=True).start()
+
+    # Runs respond(reply, *args) for one event. The reply is sent when respond
+    # and everything it scheduled are done.
+    def handle(self, reply, respond, *args):
+        scope = metrics.event()
+        uid = reply.user_id
+        previous = None
+        if uid:
+            with self.lock:
+                previous = self.open_replies.get(uid)
+                self.open_replies[uid] = reply
+            reply.when_done(lambda: self._closed(uid, reply))
+        if previous is None:
+            self._respond(scope, reply, respond, args)
+            return
+        with self.lock:
+            self.queued_behind += 1
+        previous.when_done(lambda: self._resume(scope, reply, respond, args))
+
+    def _respond(self, scope, reply, respond, args):
+        reply.when_done(scope.finish)
+        try:
+            with scope:
+                respond(reply, *args)
+        finally:
+            reply.release()
+
+    # Called from whichever thread closed the previous reply
+    def _resume(self, scope, reply, respond, args):
+        def job():
+            try:
+                self._respond(scope, reply, respond, args)
+            except Exception as e:
+                print("Error:", e)
+        if not self.lanes['fast'].submit(job):
+            job()
+
+    def _closed(self, uid, reply):
+        with self.lock:
+            if self.open_replies.get(uid) is reply:
+                del self.open_replies[uid]
+
+    # work() adds its messages to reply itself. Returns False when the work was
+    # refused because the user is over their rate or the lane is full.
+    def run(self, reply, path, work, ack=None):
+        lane = self.lanes[PATH_LANES.get(path, 'fast')]
+        if not self.limiter.allow(reply.user_id, LANE_COSTS.get(lane.name, 0)):
+            reply.add(TextSendMessage(text=RATE_LIMITED_TEXT))
+            return False
+        done = threading.Event()
+        # The copied context carries the event's metrics scope into the lane
+        context = contextvars.copy_context()
+
+        def job():
+            try:
+                context.run(work)
+            except Exception as e:
+                with self.lock:
+                    self.failed += 1
+                print("Error:", e)
+            finally:
+                with reply.lock:
+                    done.set()
+                reply.release()
+
+        reply.hold()
+        if not lane.submit(job):
+            with self.lock:
+                self.busy += 1
+            reply.add(TextSendMessage(text=BUSY_TEXT))
+            reply.release()
+            return False
+        self._schedule(self.budgets.get(path, 0), lambda: self._deadline(reply, done, ack))
+        return True
+
+    def _deadline(self, reply, done, ack):
+        with reply.lock:
+            if done.is_set():
+                with self.lock:
+                    self.on_time += 1
+                return
+            with self.lock:
+                self.deferred += 1
+            if ack and reply.token_fresh():
+                reply.add(TextSendMessage(text=ack))
+                reply.send()
+
+    def _schedule(self, delay, fn):
+        with self.timer_cond:
+            heapq.heappush(self.timers, (time.monotonic() + delay, next(self.timer_seq), fn))
+            self.timer_cond.notify()
+
+    def _run_timers(self):
+        while True:
+            with self.timer_cond:
+                while not self.timers or self.timers[0][0] > time.monotonic():
+                    self.timer_cond.wait(self.timers[0][0] - time.monotonic() if self.timers else None)
+                _, _, fn = heapq.heappop(self.timers)
+            try:
+                fn()
+            except Exception as e:
+                print("Failed to send the acknowledgement:", e)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'budgets': self.budgets,
+                'on_time': self.on_time,
+                'deferred': self.deferred,
+                'failed': self.failed,
+                'busy': self.busy,
+                'queued_behind': self.queued_behind,
+                'open_replies': len(self.open_replies),
+                'rate_limited': self.limiter.limited,
+            }
@@ -0,0 +1,147 @@
+import json
+import os
+import sys
+import threading
+from graph_db import DATABASE, get_driver, read_query, write_query, write_queries
+
+# Every statement is idempotent (IF NOT EXISTS), so this runs on each startup.
+CONSTRAINTS = [
+    'CREATE CONSTRAINT user_uid IF NOT EXISTS FOR (u:User) REQUIRE u.uid IS UNIQUE',
+]
+INDEXES = [
+    'CREATE INDEX question_text IF NOT EXISTS FOR (q:Question) ON (q.text)',
+    'CREATE INDEX question_question IF NOT EXISTS FOR (q:Question) ON (q.question)',
+    'CREATE INDEX greeting_name IF NOT EXISTS FOR (g:Greeting) ON (g.name)',
+    'CREATE INDEX answer_text IF NOT EXISTS FOR (a:Answer) ON (a.text)',
+    'CREATE INDEX response_text IF NOT EXISTS FOR (r:Response) ON (r.text)',
+    'CREATE INDEX chat_timestamp IF NOT EXISTS FOR (c:Chat) ON (c.timestamp)',
+    'CREATE INDEX chat_day IF NOT EXISTS FOR (d:ChatDay) ON (d.uid, d.day)',
+]
+
+# Native vector index on Question.embedding (Neo4j 5.11+), off unless
+# NEO4J_VECTOR_INDEX=1. distiluse-base-multilingual-cased-v2 embeds to 512 floats.
+VECTOR_INDEX = os.environ.get("NEO4J_VECTOR_INDEX", "0") == "1"
+VECTOR_DIMENSIONS = 512
+VECTOR_INDEX_QUERY = f'''
+CREATE VECTOR INDEX question_embedding IF NOT EXISTS
+FOR (q:Question) ON (q.embedding)
+OPTIONS {{indexConfig: {{`vector.dimensions`: {VECTOR_DIMENSIONS}, `vector.similarity_function`: 'cosine'}}}}
+'''
+
+_applied = False
+_lock = threading.Lock()
+
+
+def statements(vector_index=VECTOR_INDEX):
+    return CONSTRAINTS + INDEXES + ([VECTOR_INDEX_QUERY] if vector_index else [])
+
+# Schema commands cannot share a transaction with each other, so each runs on
+# its own; one failing (e.g. duplicate uids blocking the constraint) does not
+# stop the rest.
+def ensure_schema(vector_index=VECTOR_INDEX):
+    global _applied
+    with _lock:
+        if _applied:
+            return
+        for statement in statements(vector_index):
+            try:
+                write_query(statement)
+            except Exception as e:
+                print(f"Schema statement failed: {statement.strip().splitlines()[0]}: {e}")
+        _applied = True
+
+
+# Stores the sentence embedding on greeting Question nodes that lack one, so
+# the vector index has something to search.
+def backfill_embeddings(encode, batch_size=256):
+    total = 0
+    while True:
+        records = read_query(
+            'MATCH (q:Question) WHERE q.question IS NOT NULL AND q.embedding IS NULL '
+            'RETURN q.question AS question LIMIT $limit', {'limit': batch_size})
+        if not records:
+            return total
+        questions = [record['question'] for record in records]
+        vecs = encode(questions)
+        write_queries((
+            'UNWIND $rows AS row MATCH (q:Question {question: row.question}) SET q.embedding = row.embedding',
+            {'rows': [{'question': question, 'embedding': [float(x) for x in vec]}
+                      for question, vec in zip(questions, vecs)]},
+        ))
+        total += len(questions)
+
+
+# Hot lookups from both chatbots, each with a query that picks a real value to
+# profile them with.
+PROFILE_QUERIES = [
+    ('user_name',
+     'MATCH (u:User {uid: $value}) RETURN u.name AS name',
+     'MATCH (u:User) RETURN u.uid AS value LIMIT 1'),
+    ('previous_answer',
+     'MATCH (q:Question {text: $value})-[:HAS_ANSWER]->(a:Answer) RETURN a.text AS answer LIMIT 1',
+     'MATCH (q:Question) WHERE q.text IS NOT NULL RETURN q.text AS value LIMIT 1'),
+    ('greeting',
+     'MATCH (n:Greeting {name: $value}) RETURN n.msg_reply AS reply',
+     'MATCH (n:Greeting) RETURN n.name AS value LIMIT 1'),
+    ('question',
+     'MATCH (n:Question {question: $value}) RETURN n.msg_reply AS reply',
+     'MATCH (n:Question) WHERE n.question IS NOT NULL RETURN n.question AS value LIMIT 1'),
+    ('answer',
+     'MATCH (a:Answer {text: $value}) RETURN count(a) AS answers',
+     'MATCH (a:Answer) RETURN a.text AS value LIMIT 1'),
+]
+
+
+def _walk(plan):
+    yield plan
+    for child in plan.get('children', []):
+        yield from _walk(child)
+
+def profile(query, parameters):
+    with get_driver().session(database=DATABASE) as session:
+        summary = session.run('PROFILE ' + query, parameters).consume()
+    operators = list(_walk(summary.profile or {}))
+    return {
+        'db_hits': sum(op.get('dbHits', 0) for op in operators),
+        'operators': [op.get('operatorType', '').split('@')[0] for op in operators],
+    }
+
+def profile_hot_queries():
+    report = {}
+    for name, query, sample in PROFILE_QUERIES:
+        rows = read_query(sample)
+        if not rows:
+            continue
+        report[name] = profile(query, {'value': rows[0]['value']})
+    return report
+
+# PROFILE every hot lookup, apply the schema, then PROFILE again
+def before_after_report(vector_index=VECTOR_INDEX):
+    before = profile_hot_queries()
+    ensure_schema(vector_index)
+    read_query('CALL db.awaitIndexes(300)')
+    after = profile_hot_queries()
+    for name in before:
+        print(f"{name}: db hits {before[name]['db_hits']} -> {after[name]['db_hits']}")
+        print(f"    before: {' <- '.join(before[name]['operators'])}")
+        print(f"    after:  {' <- '.join(after[name]['operators'])}")
+    return before, after
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "apply":
+        ensure_schema()
+    elif command == "report":
+        before, after = before_after_report()
+        # Keep the output next to the change that needed it
+        if len(sys.argv) > 2:
+            with open(sys.argv[2], 'w') as f:
+                json.dump({'before': before, 'after': after}, f, indent=2)
+                f.write("\n")
+    elif command == "embeddings":
+        from embedding_service import encode
+        print(f"Stored {backfill_embeddings(encode)} question embeddings")
+    else:
+        print("usage: python schema.py apply|report [output.json]|embeddings")
+        sys.exit(2)
@@ -0,0 +1,95 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+SESSION_TTL = float(os.environ.get("SESSION_TTL", "1800"))
+SESSION_DB = os.environ.get("SESSION_DB")
+# Seconds between sweeps of expired rows from the shared table
+SESSION_PURGE_INTERVAL = float(os.environ.get("SESSION_PURGE_INTERVAL", "600"))
+
+
+# Shared tier for processes on the same host. Anything with the same
+# load/save methods (e.g. a Redis wrapper) can be used instead. Expired rows
+# are swept from save() every purge_interval seconds.
+class SQLiteSessionBackend:
+    def __init__(self, path, purge_interval=SESSION_PURGE_INTERVAL):
+        self.path = path
+        self.purge_interval = purge_interval
+        self.next_purge = 0.0
+        self.local = threading.local()
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS sessions (uid TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)')
+
+    def _connect(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10)
+            db.execute('PRAGMA journal_mode=WAL')
+            self.local.db = db
+        return db
+
+    def load(self, uid):
+        row = self._connect().execute('SELECT data, expires FROM sessions WHERE uid = ?', (uid,)).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return json.loads(row[0])
+
+    def save(self, uid, data, expires):
+        with self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)',
+                       (uid, json.dumps(data, ensure_ascii=False), expires))
+        if time.monotonic() >= self.next_purge:
+            self.next_purge = time.monotonic() + self.purge_interval
+            self.purge()
+
+    def purge(self):
+        with self._connect() as db:
+            return db.execute('DELETE FROM sessions WHERE expires <= ?', (time.time(),)).rowcount
+
+
+# Per-user conversation state with a TTL, kept in an in-memory LRU. With a
+# backend configured the backend is the source of truth: every read goes
+# through to it, because a user's consecutive messages can land on different
+# processes, and every update is written through.
+class SessionStore:
+    def __init__(self, ttl=SESSION_TTL, max_size=10000, backend=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.backend = backend
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _remember(self, uid, data, expires):
+        self.entries[uid] = (data, expires)
+        self.entries.move_to_end(uid)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def get(self, uid):
+        if self.backend:
+            data = self.backend.load(uid)
+            return dict(data) if data is not None else {}
+        with self.lock:
+            entry = self.entries.get(uid)
+            if entry and entry[1] > time.time():
+                self.entries.move_to_end(uid)
+                return dict(entry[0])
+        return {}
+
+    def update(self, uid, **fields):
+        data = self.get(uid)
+        data.update(fields)
+        expires = time.time() + self.ttl
+        if self.backend:
+            self.backend.save(uid, data, expires)
+        else:
+            with self.lock:
+                self._remember(uid, data, expires)
+        return dict(data)
+
+
+def default_backend():
+    return SQLiteSessionBackend(SESSION_DB) if SESSION_DB else None
@@ -0,0 +1,81 @@
+import os
+import queue
+import threading
+import time
+import zlib
+
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", "1000"))
+
+
+def event_key(event):
+    source = event.get('source', {})
+    return source.get('userId') or source.get('groupId') or source.get('roomId') or event.get('replyToken', '')
+
+
+# Runs webhook events on a pool of worker threads after the HTTP request has
+# been acknowledged. Each user is pinned to one worker queue, so a user's
+# messages are handled in order while different users run in parallel.
+class EventDispatcher:
+    def __init__(self, handle, workers=WEBHOOK_WORKERS, max_queue=WEBHOOK_QUEUE_SIZE, put_timeout=1.0):
+        self.handle = handle
+        self.put_timeout = put_timeout
+        self.queues = [queue.Queue(maxsize=max_queue) for _ in range(workers)]
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+        self.lag_total = 0.0
+        for i, events in enumerate(self.queues):
+            threading.Thread(target=self._work, args=(events,), name=f"webhook-worker-{i}", daemon=True).start()
+
+    def submit(self, event):
+        events = self.queues[zlib.crc32(event_key(event).encode()) % len(self.queues)]
+        try:
+            events.put((time.monotonic(), event), timeout=self.put_timeout)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            print("Webhook queue is full, dropping event:", event.get('webhookEventId'))
+            return False
+        with self.lock:
+            self.submitted += 1
+        return True
+
+    def _work(self, events):
+        while True:
+            enqueued, event = events.get()
+            lag = time.monotonic() - enqueued
+            with self.lock:
+                self.lag_last = lag
+                self.lag_max = max(self.lag_max, lag)
+                self.lag_total += lag
+            try:
+                self.handle(event)
+                with self.lock:
+                    self.processed += 1
+            except Exception as e:
+                with self.lock:
+                    self.failed += 1
+                print("Error:", e)
+                print(event)
+
+    def stats(self):
+        depths = [events.qsize() for events in self.queues]
+        with self.lock:
+            started = self.processed + self.failed
+            return {
+                'workers': len(self.queues),
+                'queue_depth': sum(depths),
+                'queue_depth_max': max(depths),
+                'submitted': self.submitted,
+                'processed': self.processed,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'lag_last': self.lag_last,
+                'lag_max': self.lag_max,
+                'lag_avg': self.lag_total / started if started else 0.0,
+            }
@@ -0,0 +1,254 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from graph_db import is_unavailable, write_queries
+
+SPILL_PATH = os.environ.get("WRITE_BEHIND_SPILL", "write_behind_spill.jsonl")
+# Replays Neo4j may reject a row for before it is moved to the quarantine file
+MAX_REPLAY_ATTEMPTS = int(os.environ.get("WRITE_BEHIND_MAX_ATTEMPTS", "5"))
+
+# One UNWIND statement per event kind. Kinds are flushed in this order so a
+# User created in a batch exists before rows that MATCH it.
+STATEMENTS = {
+    'save_user_info': '''
+        UNWIND $rows AS row
+        MERGE (u:User {uid: row.uid})
+        SET u.name = row.name
+    ''',
+    # Identical texts share one node; counts record how often each was seen
+    'save_response': '''
+        UNWIND $rows AS row
+        MATCH (u:User {uid: row.uid})
+        MERGE (a:Answer {text: row.answer_text})
+        SET a.count = coalesce(a.count, 0) + 1
+        MERGE (r:Response {text: row.response_msg})
+        SET r.count = coalesce(r.count, 0) + 1
+        MERGE (u)-[ua:useranswer]->(a)
+        SET ua.count = coalesce(ua.count, 0) + 1
+        MERGE (a)-[ar:response]->(r)
+        SET ar.count = coalesce(ar.count, 0) + 1
+    ''',
+    'log_chat_history': '''
+        UNWIND $rows AS row
+        MATCH (u:User {uid: row.uid})
+        CREATE (c:Chat {message: row.message, reply: row.reply, timestamp: row.timestamp})
+        CREATE (u)-[:SENT]->(c)
+    ''',
+    'log_question_answer': '''
+        UNWIND $rows AS row
+        MATCH (q:Question {text: row.question})
+        MATCH (a:Answer {text: row.answer})
+        MERGE (q)-[:HAS_ANSWER]->(a)
+    ''',
+}
+
+_STOP = object()
+
+
+# Buffers graph writes off the reply path and flushes them in batches, by size
+# or by time. Writes that cannot reach Neo4j go to an append-only spill file
+# that is replayed once the database answers again. Rows Neo4j keeps rejecting,
+# and spill lines that do not parse, end up in a quarantine file next to it.
+class WriteBehindQueue:
+    def __init__(self, batch_size=100, flush_interval=0.5, max_pending=10000,
+                 put_timeout=1.0, spill_path=SPILL_PATH, replay_interval=30.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.spill_path = spill_path
+        self.replay_interval = replay_interval
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.spill_lock = threading.Lock()
+        self.next_replay = 0.0
+        self.closed = False
+        self.quarantine_path = spill_path + ".quarantine"
+        self.counters = {'queued': 0, 'flushed': 0, 'batches': 0, 'spilled': 0, 'replayed': 0, 'failures': 0,
+                         'quarantined': 0}
+        self.thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def put(self, kind, **row):
+        if kind not in STATEMENTS:
+            raise ValueError(f"Unknown write-behind event: {kind}")
+        event = {'kind': kind, 'row': row}
+        if self.closed:
+            self._spill([event])
+            return
+        try:
+            # Blocks the caller while the buffer is full (backpressure)
+            self.queue.put(event, timeout=self.put_timeout)
+            self.counters['queued'] += 1
+        except queue.Full:
+            self._spill([event])
+
+    # Writes one event right away, for data the next message reads back (a
+    # user's name). Goes through the queue if Neo4j cannot take it now.
+    def write_now(self, kind, **row):
+        if kind not in STATEMENTS:
+            raise ValueError(f"Unknown write-behind event: {kind}")
+        if self._write([{'kind': kind, 'row': row}]) is not None:
+            self.put(kind, **row)
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['pending'] = self.queue.qsize()
+        return stats
+
+    def close(self, timeout=10.0):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self.thread.join(timeout)
+        # Anything the worker could not drain in time is kept for the next start
+        leftover = []
+        while True:
+            try:
+                event = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if event is not _STOP:
+                leftover.append(event)
+        if leftover:
+            self._spill(leftover)
+
+    def _run(self):
+        self._try_replay()
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    event = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if event is _STOP:
+                    stopping = True
+                    break
+                batch.append(event)
+            if batch:
+                try:
+                    if self._write(batch) is None:
+                        self.counters['flushed'] += len(batch)
+                    else:
+                        self._spill(batch)
+                except Exception as e:
+                    # This is the only flush thread; it must outlive a bad batch
+                    print(f"Write-behind lost {len(batch)} rows:", e)
+                    self.counters['failures'] += 1
+            if time.monotonic() >= self.next_replay and os.path.exists(self.spill_path):
+                self._try_replay()
+
+    def _try_replay(self):
+        try:
+            self._replay()
+        except Exception as e:
+            print("Write-behind replay failed:", e)
+            self.counters['failures'] += 1
+            self.next_replay = time.monotonic() + self.replay_interval
+
+    # Returns None on success, otherwise the error
+    def _write(self, batch):
+        rows = {}
+        for event in batch:
+            rows.setdefault(event['kind'], []).append(event['row'])
+        queries = [(STATEMENTS[kind], {'rows': rows[kind]}) for kind in STATEMENTS if kind in rows]
+        try:
+            write_queries(*queries)
+        except Exception as e:
+            print("Write-behind flush failed:", e)
+            self.counters['failures'] += 1
+            self.next_replay = time.monotonic() + self.replay_interval
+            return e
+        self.counters['batches'] += 1
+        return None
+
+    def _append(self, path, events):
+        with self.spill_lock:
+            with open(path, 'a', encoding='utf-8') as file:
+                for event in events:
+                    file.write(event if isinstance(event, str) else json.dumps(event, ensure_ascii=False) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+
+    def _spill(self, events):
+        self._append(self.spill_path, events)
+        self.counters['spilled'] += len(events)
+
+    # Lines that do not parse (e.g. the last line of a write cut short by a
+    # crash) are returned as raw text to be quarantined
+    def _read_spill(self, path):
+        events = []
+        unreadable = []
+        with open(path, encoding='utf-8', errors='replace') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    event = json.loads(line)
+                    if event.get('kind') not in STATEMENTS or not isinstance(event.get('row'), dict):
+                        raise ValueError("not a write-behind event")
+                except (ValueError, AttributeError):
+                    unreadable.append(line if line.endswith("\n") else line + "\n")
+                    continue
+                events.append(event)
+        return events, unreadable
+
+    def _replay(self):
+        replay_path = self.spill_path + ".replay"
+        with self.spill_lock:
+            # A leftover .replay file means a previous replay was interrupted
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spill_path):
+                    return
+                os.replace(self.spill_path, replay_path)
+        events, quarantined = self._read_spill(replay_path)
+        failed = []
+        unavailable = False
+        for i in range(0, len(events), self.batch_size):
+            batch = events[i:i + self.batch_size]
+            if unavailable:
+                failed.extend(batch)
+                continue
+            error = self._write(batch)
+            if error is None:
+                self.counters['replayed'] += len(batch)
+                continue
+            if is_unavailable(error):
+                # Neo4j is down; keep the rest for the next replay
+                unavailable = True
+                failed.extend(batch)
+                continue
+            # Neo4j rejected the batch: write its rows one at a time so a bad
+            # row does not hold back the others
+            for event in batch:
+                if unavailable:
+                    failed.append(event)
+                    continue
+                error = self._write([event])
+                if error is None:
+                    self.counters['replayed'] += 1
+                elif is_unavailable(error):
+                    unavailable = True
+                    failed.append(event)
+                else:
+                    event['attempts'] = event.get('attempts', 0) + 1
+                    (quarantined if event['attempts'] >= MAX_REPLAY_ATTEMPTS else failed).append(event)
+        if quarantined:
+            print(f"Write-behind: quarantined {len(quarantined)} unreadable or rejected rows in {self.quarantine_path}")
+            self._append(self.quarantine_path, quarantined)
+            self.counters['quarantined'] += len(quarantined)
+        if failed:
+            self._spill(failed)
+            self.counters['spilled'] -= len(failed)
+        os.remove(replay_path)
+        if not failed:
+            self.next_replay = 0.0